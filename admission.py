@@ -0,0 +1,138 @@
+import os
+import time
+import shutil
+import threading
+from mega import is_folder_url, parse_mega_url, parse_folder_url, get_file_info, get_folder_files
+from mega_api import api
+
+# Configuration
+MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "0"))
+USER_QUOTA_MB = int(os.getenv("USER_QUOTA_MB", "0"))
+TEMP_BUDGET_MB = int(os.getenv("TEMP_BUDGET_MB", "0"))
+TEMP_RESERVE_MB = int(os.getenv("TEMP_RESERVE_MB", "512"))
+TEMP_WAIT_SECONDS = int(os.getenv("TEMP_WAIT_SECONDS", "600"))
+
+MB = 1024 * 1024
+
+class AdmissionError(Exception):
+    """Raised with a user-facing message when a request is too large to accept"""
+
+def format_size(nbytes):
+    """Format bytes as MB, or GB from 1 GB up"""
+    if nbytes >= 1024 * MB:
+        return f"{nbytes / (1024 * MB):.1f} GB"
+    return f"{nbytes / MB:.1f} MB"
+
+def advertised_sizes(mega_url):
+    """File sizes Mega reports for a link, without downloading anything"""
+    if is_folder_url(mega_url):
+        folder_id, folder_key = parse_folder_url(mega_url)
+        return [f["size"] for f in get_folder_files(folder_id, folder_key)]
+    file_id, _ = parse_mega_url(mega_url)
+    return [get_file_info(file_id)["s"]]
+
+def batch_sizes(urls):
+    """Advertised sizes of many links as {url: sizes or the exception}, with all files looked up in one request"""
+    results = {}
+    file_ids = {}
+    for url in urls:
+        try:
+            if is_folder_url(url):
+                results[url] = advertised_sizes(url)
+            else:
+                file_ids[url] = parse_mega_url(url)[0]
+        except Exception as e:
+            results[url] = e
+    infos = api.files_info(list(file_ids.values()))
+    for url, file_id in file_ids.items():
+        info = infos[file_id]
+        results[url] = info if isinstance(info, Exception) else [info["s"]]
+    return {url: results[url] for url in urls}
+
+def admit(sizes, user_reserved=0):
+    """Check a request against the per-file maximum and the user's quota; return its total size"""
+    if MAX_FILE_SIZE_MB:
+        too_big = [size for size in sizes if size > MAX_FILE_SIZE_MB * MB]
+        if len(sizes) == 1 and too_big:
+            raise AdmissionError(
+                f"This file is {format_size(sizes[0])}; the limit is {MAX_FILE_SIZE_MB} MB per file"
+            )
+        if too_big:
+            raise AdmissionError(
+                f"{len(too_big)} of {len(sizes)} files are over the {MAX_FILE_SIZE_MB} MB per-file limit "
+                f"(largest {format_size(max(too_big))})"
+            )
+    total = sum(sizes)
+    if USER_QUOTA_MB and user_reserved + total > USER_QUOTA_MB * MB:
+        raise AdmissionError(
+            f"This link is {format_size(total)} and you already have {format_size(user_reserved)} in the queue; "
+            f"the limit is {USER_QUOTA_MB} MB at a time. Try again when your jobs finish."
+        )
+    return total
+
+class TempBudget:
+    """Reservations of temporary disk space for transfers that go through a file"""
+
+    def __init__(self, paths, usage, budget=TEMP_BUDGET_MB * MB, margin=TEMP_RESERVE_MB * MB):
+        self.paths = paths
+        # Callable returning bytes already written by temp and partial files
+        self.usage = usage
+        self.budget = budget
+        self.margin = margin
+        self.reserved = 0
+        self.cond = threading.Condition()
+
+    def free_disk(self):
+        """Free bytes on the fullest filesystem holding temp files"""
+        free = []
+        for path in self.paths:
+            while path and not os.path.exists(path):
+                path = os.path.dirname(path)
+            free.append(shutil.disk_usage(path or ".").free)
+        return min(free)
+
+    def capacity(self):
+        """Most one transfer could ever reserve, once every other reservation is released"""
+        capacity = self.free_disk() + self.usage() - self.margin
+        if self.budget:
+            capacity = min(capacity, self.budget)
+        return capacity
+
+    def available(self):
+        """Bytes that can be reserved right now"""
+        # Reserved transfers will still write whatever they haven't written yet
+        outstanding = max(0, self.reserved - self.usage())
+        available = self.free_disk() - outstanding - self.margin
+        if self.budget:
+            available = min(available, self.budget - self.reserved)
+        return available
+
+    def try_reserve(self, nbytes):
+        """Reserve nbytes if they fit now"""
+        with self.cond:
+            if nbytes <= self.available():
+                self.reserved += nbytes
+                return True
+            return False
+
+    def reserve(self, nbytes, timeout=TEMP_WAIT_SECONDS):
+        """Wait for nbytes to fit; False if they never can or the wait times out"""
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                if nbytes > self.capacity():
+                    return False
+                if nbytes <= self.available():
+                    self.reserved += nbytes
+                    return True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                # Disk space can also free up outside this process, so poll too
+                self.cond.wait(min(remaining, 5))
+
+    def release(self, nbytes):
+        """Return a reservation"""
+        with self.cond:
+            self.reserved -= nbytes
+            self.cond.notify_all()
@@ -0,0 +1,109 @@
+import os
+import math
+import time
+import threading
+from metrics import Counter
+
+# Configuration: MB/s per direction, 0 for unlimited
+limits = {
+    "global": float(os.getenv("BANDWIDTH_GLOBAL_MB", "0")),
+    "user": float(os.getenv("BANDWIDTH_USER_MB", "0")),
+    "job": float(os.getenv("BANDWIDTH_JOB_MB", "0")),
+}
+# Jobs up to this size take the priority lane
+PRIORITY_FILE_MB = float(os.getenv("PRIORITY_FILE_MB", "50"))
+
+MB = 1024 * 1024
+
+throttle_seconds = Counter("bandwidth_wait_seconds_total", "Time transfers spent waiting on bandwidth limits", ["direction"])
+
+class TokenBucket:
+    """Byte budget refilled at the current limit of one level, with one second of burst"""
+
+    def __init__(self, level):
+        self.level = level
+        self.tokens = 0.0
+        self.last = time.time()
+        self.priority_waiting = 0
+        self.cond = threading.Condition()
+
+    def take(self, nbytes, priority=False):
+        """Block until nbytes may be sent; bulk takers yield to waiting priority ones"""
+        with self.cond:
+            if priority:
+                self.priority_waiting += 1
+            try:
+                while True:
+                    rate = limits[self.level] * MB
+                    if not rate:
+                        return
+                    now = time.time()
+                    self.tokens = min(rate, self.tokens + (now - self.last) * rate)
+                    self.last = now
+                    # Chunks bigger than the burst go into debt instead of waiting forever
+                    need = min(nbytes, rate)
+                    if self.tokens >= need and (priority or not self.priority_waiting):
+                        self.tokens -= nbytes
+                        return
+                    self.cond.wait(max((need - self.tokens) / rate, 0.01))
+            finally:
+                if priority:
+                    self.priority_waiting -= 1
+                self.cond.notify_all()
+
+# Buckets shared by every job, per direction
+global_buckets = {"download": TokenBucket("global"), "upload": TokenBucket("global")}
+user_buckets = {}
+user_buckets_lock = threading.Lock()
+
+class JobShaper:
+    """Throttle callbacks for one job, drawing from its job, user and global buckets"""
+
+    def __init__(self, user_id, size=0):
+        self.priority = size <= PRIORITY_FILE_MB * MB
+        with user_buckets_lock:
+            if user_id not in user_buckets:
+                user_buckets[user_id] = {"download": TokenBucket("user"), "upload": TokenBucket("user")}
+            user = user_buckets[user_id]
+        self.buckets = {
+            direction: (TokenBucket("job"), user[direction], global_buckets[direction])
+            for direction in ("download", "upload")
+        }
+
+    def _take(self, direction, nbytes):
+        started = time.time()
+        for bucket in self.buckets[direction]:
+            bucket.take(nbytes, self.priority)
+        waited = time.time() - started
+        if waited > 0.001:
+            throttle_seconds.inc(waited, direction=direction)
+
+    def download(self, nbytes):
+        self._take("download", nbytes)
+
+    def upload(self, nbytes):
+        self._take("upload", nbytes)
+
+def set_limit(level, value):
+    """Change a limit (MB/s) or the priority lane size (MB) at runtime
+
+    Running transfers pick up a new limit on their next chunk.
+    """
+    global PRIORITY_FILE_MB
+    # nan slips past the comparison below and stalls every shaped transfer
+    if not math.isfinite(value):
+        raise ValueError("Limits must be numbers, use 0 for unlimited")
+    if value < 0:
+        raise ValueError("Limits can't be negative")
+    if level == "priority":
+        PRIORITY_FILE_MB = value
+    elif level in limits:
+        limits[level] = value
+    else:
+        raise ValueError(f"Unknown setting {level}, use one of: {', '.join(limits)}, priority")
+
+def describe():
+    """One line per limit, for the admin command"""
+    lines = [f"{level}: {f'{rate:g} MB/s' if rate else 'unlimited'}" for level, rate in limits.items()]
+    lines.append(f"priority lane: jobs up to {PRIORITY_FILE_MB:g} MB")
+    return "\n".join(lines)
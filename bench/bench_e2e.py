@@ -0,0 +1,220 @@
+"""End-to-end benchmark of downloads and conversions against local fake services
+
+Usage: python bench/bench_e2e.py [--mode convert] [--sizes 1M,64M,1G] [--concurrency 1,4]
+       [--jobs 8] [--latency 0.05] [--bandwidth-mb 50] [--error-rate 0.01] [--output results.json]
+
+Writes one JSON document with the run settings and one result per mode, size
+and concurrency: throughput, p50/p99 job latency, errors, peak RSS and disk use.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import contextlib
+import platform
+import resource
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+def parse_size(text):
+    """Parse 512K / 64M / 5G into bytes"""
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is KiB on Linux and bytes on macOS; it is a peak, not a current value
+        scale = 1 if platform.system() == "Darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def disk_usage(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class PeakSampler:
+    """Background thread recording peak RSS and disk use of a directory"""
+
+    def __init__(self, path, interval=0.2):
+        self.path = path
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            self.peak_rss = max(self.peak_rss, current_rss())
+            self.peak_disk = max(self.peak_disk, disk_usage(self.path))
+            if self.stopped.wait(self.interval):
+                return
+
+def run_case(mode, size, concurrency, jobs, workdir, seeds):
+    """Run jobs transfers of one size at one concurrency and summarize them"""
+    from fake_services import mega_link
+    from mega import mega_download_url
+    from transfer import convert
+
+    links = [mega_link(size, next(seeds)) for _ in range(jobs)]
+    latencies = []
+    errors = []
+
+    def job(i, url):
+        started = time.time()
+        try:
+            if mode == "download":
+                path = os.path.join(workdir, f"download_{i}")
+                mega_download_url(url, path)
+                os.remove(path)
+            else:
+                convert(url)
+            latencies.append(time.time() - started)
+        except Exception as e:
+            errors.append(str(e))
+
+    with PeakSampler(workdir) as sampler:
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(job, range(jobs), links))
+        elapsed = time.time() - started
+
+    moved = size * len(latencies)
+    return {
+        "mode": mode,
+        "size": size,
+        "concurrency": concurrency,
+        "jobs": jobs,
+        "ok": len(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "seconds": round(elapsed, 3),
+        "throughput_mb_s": round(moved / elapsed / 1048576, 2) if elapsed else None,
+        "p50_s": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "p99_s": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "peak_rss_mb": round(sampler.peak_rss / 1048576, 1),
+        "peak_disk_mb": round(sampler.peak_disk / 1048576, 1),
+    }
+
+def run_all(modes, sizes, levels, jobs, workdir, results):
+    """Run every mode, size and concurrency combination, logging each to stderr"""
+    seeds = iter(range(1, 1 << 30))
+    for mode in modes:
+        for size in sizes:
+            for concurrency in levels:
+                result = run_case(mode, size, concurrency, jobs or concurrency * 2, workdir, seeds)
+                results.append(result)
+                print(
+                    f"{mode:8} {size / 1048576:>8.1f} MB x{concurrency:<3} "
+                    f"{result['throughput_mb_s'] or 0:>8.1f} MB/s  p50 {result['p50_s']}s  p99 {result['p99_s']}s  "
+                    f"errors {result['errors']}  rss {result['peak_rss_mb']} MB  disk {result['peak_disk_mb']} MB"
+                )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["download", "convert", "both"], default="both")
+    parser.add_argument("--sizes", default="1M,64M,256M", help="comma-separated, e.g. 1M,1G,5G")
+    parser.add_argument("--concurrency", default="1,4", help="comma-separated thread counts")
+    parser.add_argument("--jobs", type=int, default=0, help="jobs per case (default: 2x concurrency)")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every fake request")
+    parser.add_argument("--bandwidth-mb", type=float, default=0, help="MB/s cap per fake connection")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of fake requests failing")
+    parser.add_argument("--workdir", default=None, help="directory for downloads and temp files")
+    parser.add_argument("--output", default=None, help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    # The bot's modules read their endpoints at import time, so set them first
+    port = free_port()
+    from fake_services import serve, service_env
+    os.environ.update(service_env(port))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_e2e_")
+    os.makedirs(workdir, exist_ok=True)
+    os.environ.setdefault("PARTIAL_DIR", os.path.join(workdir, "partials"))
+    tempfile.tempdir = workdir
+
+    ready = multiprocessing.Queue()
+    services = multiprocessing.Process(
+        target=serve, args=(port, args.latency, args.bandwidth_mb, args.error_rate, ready), daemon=True
+    )
+    services.start()
+    ready.get(timeout=10)
+
+    modes = ["download", "convert"] if args.mode == "both" else [args.mode]
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = []
+    try:
+        # The bot's own progress prints would corrupt JSON written to stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            run_all(modes, sizes, levels, args.jobs, workdir, results)
+    finally:
+        services.terminate()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "latency": args.latency,
+            "bandwidth_mb": args.bandwidth_mb,
+            "error_rate": args.error_rate,
+            "env": {name: os.environ[name] for name in (
+                "DOWNLOAD_CONNECTIONS", "DOWNLOAD_SEGMENT_MB", "STREAM_TRANSFERS", "STREAM_BUFFER_MB",
+                "MAX_DOWNLOADS", "MAX_UPLOADS",
+            ) if name in os.environ},
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
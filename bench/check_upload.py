@@ -0,0 +1,115 @@
+"""Upload checks against a real HTTP server instead of the fake services
+
+The fake GoFile only reads Content-Length, so framing mistakes in the upload
+request can pass the benchmarks. This serves GoFile's upload endpoints from
+Werkzeug, which parses requests like a production server, and checks that
+every upload path delivers the file intact.
+
+Usage: python bench/check_upload.py [--size-mb 3]
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+# Digest of every file part received, by name
+received = {}
+# Servers that answer uploads with 503
+failing = set()
+
+@Request.application
+def app(request):
+    if request.path == "/servers":
+        servers = [{"name": "store1"}, {"name": "store2"}]
+        return Response(json.dumps({"status": "ok", "data": {"servers": servers}}), mimetype="application/json")
+    upload = request.files.get("file")
+    if request.method != "POST" or not request.path.endswith("/uploadFile") or upload is None:
+        return Response('{"status":"error","message":"bad upload"}', status=400, mimetype="application/json")
+    if request.path.split("/")[1] in failing:
+        return Response('{"status":"error","message":"unavailable"}', status=503, mimetype="application/json")
+    received[upload.filename] = hashlib.sha256(upload.read()).hexdigest()
+    data = {
+        "downloadPage": "https://gofile.io/d/check",
+        "code": "check",
+        "guestToken": "token",
+        "parentFolder": request.form.get("folderId", "folder"),
+    }
+    return Response(json.dumps({"status": "ok", "data": data}), mimetype="application/json")
+
+def start_server():
+    # Hide the line logged per request; failures still log their tracebacks
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_port
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=3)
+    args = parser.parse_args()
+
+    port = start_server()
+    os.environ["GOFILE_API_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["GOFILE_UPLOAD_URL"] = f"http://127.0.0.1:{port}/{{server}}/uploadFile"
+    # Imported after the environment points it at the local server
+    import gofile
+
+    content = os.urandom(int(args.size_mb * 1024 * 1024))
+    digest = hashlib.sha256(content).hexdigest()
+    failures = []
+
+    def check(name, run, expected):
+        received.clear()
+        try:
+            run()
+        except Exception as e:
+            failures.append(name)
+            print(f"FAIL {name}: {str(e)}")
+            return
+        if received != expected:
+            failures.append(name)
+            print(f"FAIL {name}: server received {received}, expected {expected}")
+            return
+        print(f"ok   {name}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "check.bin")
+        with open(path, "wb") as f:
+            f.write(content)
+
+        check("streamed upload", lambda: gofile.upload_stream(iter([content]), "check.bin", len(content)),
+              {"check.bin": digest})
+        check("upload from file", lambda: gofile.upload_file(path, "check.bin"), {"check.bin": digest})
+
+        # The preferred server fails, so the upload moves to the other one and it ranks first
+        failing.add(gofile.get_upload_server())
+        check("retry on another server", lambda: gofile.upload_file(path, "check.bin"), {"check.bin": digest})
+        if gofile.get_upload_server() in failing:
+            failures.append("failed server ranking")
+            print("FAIL failed server ranking: the failing server is still preferred")
+        failing.clear()
+
+        parts = 3
+        part_size = -(-len(content) // parts)
+        gofile.GOFILE_PARALLEL_MB = args.size_mb / 2
+        gofile.GOFILE_PARALLEL_PARTS = parts
+        expected = {
+            f"check.bin.{i + 1:03d}": hashlib.sha256(content[start:start + part_size]).hexdigest()
+            for i, start in enumerate(range(0, len(content), part_size))
+        }
+        check("upload in parts", lambda: gofile.upload_file(path, "check.bin"), expected)
+
+    if failures:
+        sys.exit(f"{len(failures)} check(s) failed")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Local stand-ins for the Mega API, Mega storage and GoFile upload servers
+
+Files are synthetic: file ID "s<size>x<seed>" is <size> zero bytes encrypted
+with a key derived from <seed>, so any range can be generated on the fly and
+multi-GB files never exist in memory or on disk.
+
+Usage: python bench/fake_services.py [--port 8900] [--latency 0.05] [--bandwidth-mb 50] [--error-rate 0.01]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import base64
+import hashlib
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Crypto.Cipher import AES
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PIECE_SIZE = 1024 * 1024
+
+def file_keys(seed):
+    """AES key and nonce of a synthetic file"""
+    digest = hashlib.sha256(f"bench-{seed}".encode()).digest()
+    return digest[:16], digest[16:24]
+
+def link_key(size, seed):
+    """The 32-byte link key (key, nonce and meta-MAC) of a synthetic file"""
+    # Imported here so callers can point the bot's modules at these services first
+    from mega import mega_chunk_bounds, xor_bytes
+    key, nonce = file_keys(seed)
+    ecb = AES.new(key, AES.MODE_ECB)
+    file_mac = bytes(16)
+    # All-zero plaintext: every chunk of the same length has the same CBC-MAC
+    chunk_macs = {}
+    for start, end in mega_chunk_bounds(size):
+        length = end - start
+        if length not in chunk_macs:
+            cbc = AES.new(key, AES.MODE_CBC, iv=nonce + nonce)
+            chunk_macs[length] = cbc.encrypt(bytes(length + -length % 16))[-16:]
+        file_mac = ecb.encrypt(xor_bytes(file_mac, chunk_macs[length]))
+    meta_mac = xor_bytes(file_mac[0:4], file_mac[4:8]) + xor_bytes(file_mac[8:12], file_mac[12:16])
+    return xor_bytes(key, nonce + meta_mac) + nonce + meta_mac
+
+def mega_link(size, seed):
+    """A Mega file link the fake API will resolve"""
+    key = base64.urlsafe_b64encode(link_key(size, seed)).decode().rstrip('=')
+    return f"https://mega.nz/file/s{size}x{seed}#{key}"
+
+def encrypted_attributes(name, seed):
+    key, _ = file_keys(seed)
+    attr = b'MEGA' + json.dumps({"n": name}).encode()
+    attr += b'\0' * (-len(attr) % 16)
+    cbc = AES.new(key, AES.MODE_CBC, iv=bytes(16))
+    return base64.urlsafe_b64encode(cbc.encrypt(attr)).decode().rstrip('=')
+
+class FakeServices(BaseHTTPRequestHandler):
+    """One handler for the Mega API, Mega storage and GoFile endpoints"""
+    protocol_version = "HTTP/1.1"
+    latency = 0
+    bandwidth = 0
+    error_rate = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def base_url(self):
+        return f"http://{self.headers.get('Host')}"
+
+    def injected_failure(self):
+        """Apply the configured latency, then fail the request at the error rate"""
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.reply(500, b'{"status":"error","message":"injected failure"}')
+            return True
+        return False
+
+    def reply(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def throttle(self, started, nbytes):
+        """Sleep until nbytes fits within the per-connection bandwidth cap"""
+        if self.bandwidth:
+            ahead = nbytes / self.bandwidth - (time.time() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if self.path.startswith("/cs"):
+            payload = json.loads(self.rfile.read(length))
+            if self.injected_failure():
+                return
+            self.reply(200, json.dumps([self.mega_command(command) for command in payload]).encode())
+        elif self.path.endswith("/uploadFile"):
+            if "Transfer-Encoding" in self.headers and "Content-Length" in self.headers:
+                # Real servers and proxies can't tell where such a body ends
+                self.close_connection = True
+                self.reply(400, b'{"status":"error","message":"both Content-Length and Transfer-Encoding"}')
+                return
+            self.receive_upload(length)
+        else:
+            self.reply(404, b'{}')
+
+    def mega_command(self, command):
+        """Answer an a:"g" command with a download URL on this server"""
+        match = re.fullmatch(r"s(\d+)x(\d+)", command.get("p") or command.get("n") or "")
+        if command.get("a") != "g" or not match:
+            return -2
+        size, seed = int(match.group(1)), int(match.group(2))
+        return {
+            "g": f"{self.base_url()}/dl/{match.group(0)}",
+            "s": size,
+            "at": encrypted_attributes(f"bench_{size}_{seed}.bin", seed),
+        }
+
+    def receive_upload(self, length):
+        """Read and discard an upload body at the capped rate"""
+        started = time.time()
+        received = 0
+        while received < length:
+            piece = self.rfile.read(min(PIECE_SIZE, length - received))
+            if not piece:
+                return
+            received += len(piece)
+            self.throttle(started, received)
+        if self.injected_failure():
+            return
+        code = hashlib.sha1(f"{time.time()}-{received}".encode()).hexdigest()[:8]
+        data = {
+            "downloadPage": f"{self.base_url()}/d/{code}",
+            "code": code,
+            "parentFolder": "bench-folder",
+            "guestToken": "bench-token",
+        }
+        self.reply(200, json.dumps({"status": "ok", "data": data}).encode())
+
+    def do_GET(self):
+        if self.path == "/servers":
+            if self.injected_failure():
+                return
+            servers = [{"name": "bench1"}, {"name": "bench2"}]
+            self.reply(200, json.dumps({"status": "ok", "data": {"servers": servers}}).encode())
+            return
+        match = re.fullmatch(r"/dl/s(\d+)x(\d+)(?:/(\d+)-(\d+))?", self.path)
+        if not match:
+            self.reply(404, b'{}')
+            return
+        if self.injected_failure():
+            return
+        size, seed = int(match.group(1)), int(match.group(2))
+        start = int(match.group(3) or 0)
+        end = int(match.group(4)) + 1 if match.group(4) else size
+        self.send_encrypted(seed, start, min(end, size))
+
+    def send_encrypted(self, seed, start, end):
+        """Stream bytes [start, end) of the file's ciphertext"""
+        key, nonce = file_keys(seed)
+        aligned = start - start % 16
+        ctr = AES.new(key, AES.MODE_CTR, nonce=nonce, initial_value=aligned // 16)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        started = time.time()
+        skip = start - aligned
+        position = aligned
+        try:
+            while position < end:
+                piece = ctr.encrypt(bytes(min(PIECE_SIZE, end - position)))
+                self.wfile.write(piece[skip:])
+                position += len(piece)
+                skip = 0
+                self.throttle(started, position - start)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def serve(port=0, latency=0, bandwidth_mb=0, error_rate=0, ready=None):
+    """Run the fake services until the process exits; ready receives the port"""
+    FakeServices.latency = latency
+    FakeServices.bandwidth = bandwidth_mb * 1024 * 1024
+    FakeServices.error_rate = error_rate
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeServices)
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_port)
+    server.serve_forever()
+
+def service_env(port):
+    """Environment that points the bot's clients at the fake services"""
+    base = f"http://127.0.0.1:{port}"
+    return {
+        "MEGA_API_URL": base,
+        "GOFILE_API_URL": base,
+        "GOFILE_UPLOAD_URL": base + "/upload/{server}/uploadFile",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every request")
+    parser.add_argument("--bandwidth-mb", type=float, default=0, help="MB/s cap per connection, 0 for none")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with 500")
+    args = parser.parse_args()
+
+    for name, value in service_env(args.port).items():
+        print(f"export {name}='{value}'")
+    print(f"Example link: {mega_link(1024 * 1024, 1)}")
+    serve(args.port, args.latency, args.bandwidth_mb, args.error_rate)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from transport import session
+from metrics import upload_throughput, transfer_errors
+import tracing
+
+# Configuration
+GOFILE_SERVERS_TTL = int(os.getenv("GOFILE_SERVERS_TTL", "300"))
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+GOFILE_API_URL = os.getenv("GOFILE_API_URL", "https://api.gofile.io")
+GOFILE_UPLOAD_URL = os.getenv("GOFILE_UPLOAD_URL", "https://{server}.gofile.io/uploadFile")
+GOFILE_IDLE_TIMEOUT = float(os.getenv("GOFILE_IDLE_TIMEOUT", "60"))
+GOFILE_RESPONSE_TIMEOUT = float(os.getenv("GOFILE_RESPONSE_TIMEOUT", "300"))
+GOFILE_UPLOAD_ATTEMPTS = int(os.getenv("GOFILE_UPLOAD_ATTEMPTS", "3"))
+GOFILE_PARALLEL_MB = int(os.getenv("GOFILE_PARALLEL_MB", "0"))
+GOFILE_PARALLEL_PARTS = int(os.getenv("GOFILE_PARALLEL_PARTS", "4"))
+# urllib3 times out each socket send with the connect timeout, so small sends
+# turn GOFILE_IDLE_TIMEOUT into "no progress for that long" rather than a total
+SEND_PIECE_SIZE = 64 * 1024
+
+# Cached server list and smoothed upload throughput (bytes/s) per server
+servers = []
+servers_fetched = 0
+server_speeds = {}
+servers_lock = threading.Lock()
+
+def list_servers():
+    """Return GoFile upload server names, refreshed every GOFILE_SERVERS_TTL seconds"""
+    global servers, servers_fetched
+    with servers_lock:
+        if servers and time.time() - servers_fetched < GOFILE_SERVERS_TTL:
+            return list(servers)
+    try:
+        with tracing.span("gofile.servers"):
+            server_resp = session.get(f'{GOFILE_API_URL}/servers', timeout=10)
+            server_resp.raise_for_status()
+            names = [server['name'] for server in server_resp.json()['data']['servers']]
+    except Exception:
+        transfer_errors.inc(phase="gofile_servers")
+        raise
+    with servers_lock:
+        servers = names
+        servers_fetched = time.time()
+        for name in list(server_speeds):
+            if name not in names:
+                del server_speeds[name]
+    return list(names)
+
+def get_upload_server(exclude=()):
+    """Pick the server with the best measured upload throughput, avoiding exclude if possible"""
+    names = list_servers()
+    names = [name for name in names if name not in exclude] or names
+    with servers_lock:
+        # Servers we haven't measured yet are tried first
+        unmeasured = [name for name in names if name not in server_speeds]
+        if unmeasured:
+            return unmeasured[0]
+        return max(names, key=lambda name: server_speeds[name])
+
+def record_upload(server, nbytes, seconds, ok=True, server_fault=True):
+    """Record one upload attempt's throughput and fold it into the server's moving average
+
+    Failures that aren't the server's fault, such as a rejected request,
+    would fail on every server, so they leave its ranking alone.
+    """
+    speed = nbytes / max(seconds, 0.001)
+    upload_throughput.observe(speed, outcome="success" if ok else "failure")
+    if not ok:
+        transfer_errors.inc(phase="upload")
+        if not server_fault:
+            return
+        # A server that fails ranks below every working one
+        speed = 0
+    with servers_lock:
+        previous = server_speeds.get(server)
+        server_speeds[server] = speed if previous is None else 0.7 * previous + 0.3 * speed
+
+def send_pieces(chunks, on_sent=None, throttle=None):
+    """Cut chunks into small sends, throttling and counting them"""
+    for chunk in chunks:
+        view = memoryview(chunk)
+        for start in range(0, len(view), SEND_PIECE_SIZE):
+            piece = view[start:start + SEND_PIECE_SIZE]
+            # Charged per piece, so a big chunk can't go out as one burst
+            if throttle:
+                throttle(len(piece))
+            yield piece
+            if on_sent:
+                on_sent(len(piece))
+
+class UploadBody:
+    """A multipart body streamed from pieces whose total length is known
+
+    requests sends an iterable with a length as Content-Length; a plain
+    generator would get Transfer-Encoding: chunked instead.
+    """
+
+    def __init__(self, head, pieces, size, tail):
+        self.head = head
+        self.pieces = pieces
+        self.size = size
+        self.tail = tail
+        self.sent = 0
+
+    def __len__(self):
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        for piece in self.pieces:
+            yield piece
+            self.sent += len(piece)
+        yield self.tail
+
+def post_upload(server, pieces, filename, size, fields=None):
+    """POST one upload attempt to a server as a streamed multipart body"""
+    boundary, head, tail = multipart_envelope(filename, fields=fields)
+    body = UploadBody(head, pieces, size, tail)
+    headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    started = time.time()
+    with tracing.span("upload", server=server, file=filename) as span:
+        try:
+            gofile_resp = session.post(
+                GOFILE_UPLOAD_URL.format(server=server),
+                data=body,
+                headers=headers,
+                # Idle limit while sending; GoFile may take a while to answer once it has the file
+                timeout=(GOFILE_IDLE_TIMEOUT, GOFILE_RESPONSE_TIMEOUT)
+            )
+            data = parse_upload_response(gofile_resp)
+        except Exception as e:
+            record_upload(server, body.sent, time.time() - started, ok=False, server_fault=retryable(e))
+            raise
+        finally:
+            span["bytes"] = body.sent
+    record_upload(server, body.sent, time.time() - started)
+    return data
+
+def retryable(error):
+    """Whether an upload attempt failed in a way another server might not"""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    return isinstance(error, requests.RequestException)
+
+def parse_upload_response(gofile_resp):
+    """Return the data section of a GoFile upload response"""
+    gofile_resp.raise_for_status()
+    data = gofile_resp.json()
+    if data.get('status') != 'ok':
+        raise Exception(f"GoFile upload failed: {data.get('message', 'Unknown error')}")
+    return data['data']
+
+def read_range(file_path, start, length):
+    """Yield blocks of bytes [start, start + length) of a file"""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(UPLOAD_BLOCK_SIZE, length))
+            if not block:
+                return
+            length -= len(block)
+            yield block
+
+def upload_range(file_path, filename, start, length, fields=None, on_sent=None, throttle=None):
+    """Upload part of a file from disk, trying other servers when an attempt fails"""
+    tried = []
+    for attempt in range(GOFILE_UPLOAD_ATTEMPTS):
+        server = get_upload_server(exclude=tried)
+        tried.append(server)
+        counted = 0
+        
+        def count(nbytes):
+            nonlocal counted
+            counted += nbytes
+            if on_sent:
+                on_sent(nbytes)
+        
+        try:
+            pieces = send_pieces(read_range(file_path, start, length), count, throttle)
+            return post_upload(server, pieces, filename, length, fields)
+        except Exception as e:
+            # Take back the progress of the failed attempt
+            if on_sent and counted:
+                on_sent(-counted)
+            if not retryable(e) or attempt == GOFILE_UPLOAD_ATTEMPTS - 1:
+                raise
+            print(f"Upload of {filename} to {server} failed, trying another server: {str(e)}")
+
+def upload_file(file_path, filename, fields=None, on_sent=None, throttle=None):
+    """Upload a file from disk to GoFile.io, with optional form fields such as folderId"""
+    size = os.path.getsize(file_path)
+    if GOFILE_PARALLEL_MB and size > GOFILE_PARALLEL_MB * 1024 * 1024 and GOFILE_PARALLEL_PARTS > 1:
+        return upload_parts(file_path, filename, size, fields, on_sent, throttle)
+    return upload_range(file_path, filename, 0, size, fields, on_sent, throttle)
+
+def upload_parts(file_path, filename, size, fields=None, on_sent=None, throttle=None):
+    """Upload a large file as numbered parts of one GoFile folder, several at a time
+
+    The parts are named like split(1) output (name.001, name.002, ...) and
+    join back with cat. The first part goes alone so the folder exists
+    before the others are sent into it.
+    """
+    part_size = -(-size // GOFILE_PARALLEL_PARTS)
+    parts = [(f"{filename}.{i + 1:03d}", start, min(part_size, size - start))
+             for i, start in enumerate(range(0, size, part_size))]
+    name, start, length = parts[0]
+    first = upload_range(file_path, name, start, length, fields, on_sent, throttle)
+    fields = fields or folder_fields(first)
+    with ThreadPoolExecutor(max_workers=len(parts) - 1 or 1) as executor:
+        futures = [
+            executor.submit(tracing.bind(upload_range), file_path, name, start, length, fields, on_sent, throttle)
+            for name, start, length in parts[1:]
+        ]
+        for future in futures:
+            future.result()
+    return {**first, "parts": len(parts)}
+
+def multipart_envelope(filename, field='file', fields=None):
+    """Build boundary, head and tail bytes for a single-file multipart body"""
+    boundary = uuid.uuid4().hex
+    safe_name = filename.replace('"', '_').replace('\r', '_').replace('\n', '_')
+    head = ''.join(
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+        f'{value}\r\n'
+        for name, value in (fields or {}).items()
+    )
+    head = (
+        head +
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{safe_name}"\r\n'
+        'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode()
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+    return boundary, head, tail
+
+def upload_stream(chunks, filename, size, fields=None, on_sent=None, throttle=None):
+    """Upload a file to GoFile.io from an iterator of chunks without touching disk
+
+    The chunks can only be read once, so there is a single attempt; callers
+    fall back to a temporary file, whose upload can be retried.
+    """
+    return post_upload(get_upload_server(), send_pieces(chunks, on_sent, throttle), filename, size, fields)
+
+def folder_fields(data):
+    """Form fields that put further uploads into the same folder as a previous one"""
+    if not data.get('guestToken'):
+        raise Exception("GoFile did not return a guest token for the folder")
+    return {'token': data['guestToken'], 'folderId': data['parentFolder']}
+
+def link_alive(code):
+    """Cheap check that a GoFile link still exists; only a definite 'not found' is dead"""
+    try:
+        resp = session.get(f'{GOFILE_API_URL}/contents/{code}', timeout=5)
+        if resp.status_code == 404:
+            return False
+        return resp.json().get('status') != 'error-notFound'
+    except Exception:
+        return True
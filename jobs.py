@@ -0,0 +1,252 @@
+import os
+import time
+import socket
+import itertools
+import threading
+from collections import deque
+from metrics import queue_wait_seconds, jobs_running
+from journal import fair_order
+
+# Configuration
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "20"))
+WORKER_NAME = os.getenv("WORKER_NAME") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", "60"))
+HEARTBEAT_SECONDS = int(os.getenv("HEARTBEAT_SECONDS", "15"))
+QUEUE_POLL_SECONDS = float(os.getenv("QUEUE_POLL_SECONDS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+class QueueFull(Exception):
+    """Raised when the job queue has reached MAX_QUEUE pending jobs"""
+
+class Job:
+    """A conversion request waiting for or running on the worker pool"""
+    _ids = itertools.count(1)
+
+    def __init__(self, user_id, chat_id, mega_url, status_msg=None, job_id=None):
+        self.id = job_id if job_id is not None else next(Job._ids)
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.mega_url = mega_url
+        self.status_msg = status_msg
+        # Status messages of later requests for the same file
+        self.followers = []
+        self.cache_key = None
+        # Advertised bytes, counted against the user's quota while queued or running
+        self.size = 0
+        self.created = time.time()
+        self.started = None
+        # Final (text, options) once the job's result has been sent, and whether it succeeded
+        self.result = None
+        self.success = None
+        self.progress = None
+        # Set on jobs loaded from the shared queue
+        self.message_id = None
+        self.attempts = 0
+
+def job_from_row(row):
+    """Rebuild a job from its journal row"""
+    job = Job(row["user_id"], row["chat_id"], row["mega_url"], job_id=row["id"])
+    job.cache_key = row["cache_key"]
+    job.size = row["size"] or 0
+    job.created = row["created"]
+    job.message_id = row["message_id"]
+    job.attempts = row["attempts"] or 0
+    return job
+
+class JobScheduler:
+    """Bounded job queue served round-robin per user by a pool of threads"""
+
+    def __init__(self, runner, workers=JOB_WORKERS, max_queue=MAX_QUEUE):
+        self.runner = runner
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = {}
+        self.users = deque()
+        self.running = {}
+        self.cond = threading.Condition()
+
+    def start(self):
+        """Start the worker threads"""
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+
+    def submit(self, job, force=False):
+        """Queue a job and return its 1-based position; force skips the depth limit"""
+        with self.cond:
+            if self.queued() >= self.max_queue and not force:
+                raise QueueFull(f"Queue is full ({self.max_queue} jobs waiting)")
+            if job.user_id not in self.pending:
+                self.pending[job.user_id] = deque()
+                self.users.append(job.user_id)
+            self.pending[job.user_id].append(job)
+            self.cond.notify()
+            return self._order().index(job) + 1
+
+    def queued(self):
+        """Number of jobs waiting for a worker"""
+        with self.cond:
+            return sum(len(jobs) for jobs in self.pending.values())
+
+    def next_position(self, user_id):
+        """Position a new job from this user would get if submitted now"""
+        with self.cond:
+            return self._order(extra_user=user_id).index(None) + 1
+
+    def _order(self, extra_user=None):
+        """Pending jobs in the order workers will take them"""
+        queues = [list(self.pending[user]) for user in self.users]
+        if extra_user is not None:
+            # A placeholder for a job not queued yet
+            if extra_user in self.pending:
+                queues[list(self.users).index(extra_user)].append(None)
+            else:
+                queues.append([None])
+        order = []
+        while any(queues):
+            for jobs in queues:
+                if jobs:
+                    order.append(jobs.pop(0))
+        return order
+
+    def running_jobs(self):
+        """Jobs this process is running"""
+        with self.cond:
+            return list(self.running.values())
+
+    def user_jobs(self, user_id):
+        """Return (job, position) pairs for a user; position is None once running"""
+        with self.cond:
+            running = [(job, None) for job in self.running.values() if job.user_id == user_id]
+            order = self._order()
+            queued = [(job, i + 1) for i, job in enumerate(order) if job.user_id == user_id]
+            return running + queued, len(order)
+
+    def _next(self):
+        with self.cond:
+            while not self.users:
+                self.cond.wait()
+            # Take one job from the user at the head, then move them to the back
+            user = self.users.popleft()
+            job = self.pending[user].popleft()
+            if self.pending[user]:
+                self.users.append(user)
+            else:
+                del self.pending[user]
+            job.started = time.time()
+            queue_wait_seconds.observe(job.started - job.created)
+            self.running[job.id] = job
+            return job
+
+    def _work(self):
+        while True:
+            job = self._next()
+            try:
+                with jobs_running.track():
+                    self.runner(job)
+            except Exception as e:
+                print(f"Job {job.id} crashed: {str(e)}")
+            finally:
+                with self.cond:
+                    self.running.pop(job.id, None)
+
+class SharedScheduler:
+    """Job queue kept in the journal, served by worker threads in any number of processes
+
+    Workers lease the jobs they take and renew the leases while the jobs run,
+    so the jobs of a crashed process go back to the queue once theirs expire.
+    The processes must share the journal file on one host.
+    """
+
+    def __init__(self, journal, runner, workers=JOB_WORKERS, max_queue=MAX_QUEUE):
+        self.journal = journal
+        self.runner = runner
+        self.workers = workers
+        self.max_queue = max_queue
+        self.running = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+
+    def start(self):
+        """Start the worker threads and the heartbeat, if this process runs jobs"""
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+        if self.workers:
+            threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def stop(self):
+        """Hand this process's jobs back to the queue"""
+        self.journal.release(WORKER_NAME)
+
+    def submit(self, job, force=False):
+        """Queue a job the journal already holds and return its 1-based position"""
+        if self.queued() >= self.max_queue and not force:
+            raise QueueFull(f"Queue is full ({self.max_queue} jobs waiting)")
+        self.journal.update(job.id, state="queued")
+        self.wake.set()
+        order = self._order()
+        return next((i + 1 for i, row in enumerate(order) if row["id"] == job.id), len(order))
+
+    def queued(self):
+        """Number of jobs waiting for a worker in any process"""
+        return len(self.journal.waiting(LEASE_SECONDS))
+
+    def next_position(self, user_id):
+        """Position a new job from this user would get if submitted now"""
+        placeholder = {"id": float("inf"), "user_id": user_id}
+        waiting = self.journal.waiting(LEASE_SECONDS)
+        return fair_order(waiting + [placeholder], self.journal.running()).index(placeholder) + 1
+
+    def _order(self):
+        return fair_order(self.journal.waiting(LEASE_SECONDS), self.journal.running())
+
+    def running_jobs(self):
+        """Jobs this process is running"""
+        with self.lock:
+            return list(self.running.values())
+
+    def user_jobs(self, user_id):
+        """Return (job, position) pairs for a user; position is None once running"""
+        running = [(job_from_row(row), None) for row in self.journal.running() if row["user_id"] == user_id]
+        order = self._order()
+        queued = [(job_from_row(row), i + 1) for i, row in enumerate(order) if row["user_id"] == user_id]
+        return running + queued, len(order)
+
+    def _next(self):
+        while True:
+            row = self.journal.claim(WORKER_NAME, LEASE_SECONDS)
+            if row:
+                job = job_from_row(row)
+                job.started = time.time()
+                queue_wait_seconds.observe(job.started - job.created)
+                with self.lock:
+                    self.running[job.id] = job
+                return job
+            # Other processes don't wake us, so poll as well
+            self.wake.wait(QUEUE_POLL_SECONDS)
+            self.wake.clear()
+
+    def _work(self):
+        while True:
+            job = self._next()
+            try:
+                with jobs_running.track():
+                    self.runner(job)
+            except Exception as e:
+                print(f"Job {job.id} crashed: {str(e)}")
+            finally:
+                with self.lock:
+                    self.running.pop(job.id, None)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with self.lock:
+                job_ids = list(self.running)
+            try:
+                lost = self.journal.renew(WORKER_NAME, job_ids, LEASE_SECONDS)
+            except Exception as e:
+                print(f"Error renewing job leases: {str(e)}")
+                continue
+            for job_id in lost:
+                print(f"⚠️ Lost the lease on job {job_id}; another worker may run it too")
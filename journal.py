@@ -0,0 +1,205 @@
+import time
+import sqlite3
+import threading
+from collections import Counter
+
+# Jobs a worker can claim: queued, or running under a lease that ran out.
+# A 'new' job is still being set up by the bot; it only counts once it is stale.
+WAITING = (
+    "state = 'queued'"
+    " OR (state IN ('running', 'uploading') AND COALESCE(lease_until, 0) < :now)"
+    " OR (state = 'new' AND updated < :stale)"
+)
+RUNNING = "state IN ('running', 'uploading') AND lease_until >= :now"
+
+def fair_order(waiting, running):
+    """Waiting rows in the order workers take them: round-robin by user
+
+    A job ranks behind everything its user already has running or queued
+    ahead of it, so one user's burst doesn't hold up everyone else.
+    """
+    busy = Counter(row["user_id"] for row in running)
+    seen = Counter()
+    ranked = []
+    for row in sorted(waiting, key=lambda row: row["id"]):
+        ranked.append((busy[row["user_id"]] + seen[row["user_id"]], row["id"], row))
+        seen[row["user_id"]] += 1
+    return [row for _, _, row in sorted(ranked, key=lambda item: item[:2])]
+
+class Journal:
+    """SQLite record of unfinished jobs so they survive worker restarts"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        # Several processes may share the file, so wait out their write locks
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id INTEGER, chat_id INTEGER, message_id INTEGER, mega_url TEXT,"
+            " state TEXT DEFAULT 'queued', name TEXT, size INTEGER,"
+            " bytes_done INTEGER DEFAULT 0, file_mac TEXT, partial_path TEXT,"
+            " created REAL, updated REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS followers (job_id INTEGER, chat_id INTEGER, message_id INTEGER, user_id INTEGER)"
+        )
+        self._migrate()
+
+    def _migrate(self):
+        """Add the shared queue and follower columns to journals created before them"""
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        for name, kind in [("cache_key", "TEXT"), ("worker", "TEXT"), ("lease_until", "REAL"),
+                           ("attempts", "INTEGER DEFAULT 0")]:
+            if name not in columns:
+                self.db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(followers)")}
+        if "user_id" not in columns:
+            self.db.execute("ALTER TABLE followers ADD COLUMN user_id INTEGER")
+
+    def add(self, user_id, chat_id, message_id, mega_url, cache_key=None, size=0, state="queued"):
+        """Record a new job and return its id"""
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO jobs (user_id, chat_id, message_id, mega_url, cache_key, size, state, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, chat_id, message_id, mega_url, cache_key, size, state, now, now)
+            )
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        """Return a job's row as a dict, or None"""
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id, **fields):
+        """Update columns of a job's row"""
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def start(self, job_id):
+        """Mark a job running, keeping an upload that is being resumed"""
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET state = 'running', updated = ? WHERE id = ? AND state != 'uploading'",
+                (time.time(), job_id)
+            )
+
+    def checkpoint(self, job_id, bytes_done, file_mac):
+        """Record the last offset whose data is on disk and folded into the MAC"""
+        self.update(job_id, bytes_done=bytes_done, file_mac=file_mac.hex())
+
+    def remove(self, job_id):
+        """Forget a finished or failed job"""
+        with self.lock:
+            self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self.db.execute("DELETE FROM followers WHERE job_id = ?", (job_id,))
+
+    def find(self, cache_key):
+        """The unfinished job for a cache key, or None"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM jobs WHERE cache_key = ? AND state != 'done' ORDER BY id LIMIT 1", (cache_key,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def add_follower(self, job_id, chat_id, message_id, user_id=None):
+        """Have a job's result sent to another message too; False if the job already finished"""
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO followers (job_id, chat_id, message_id, user_id)"
+                " SELECT id, ?, ?, ? FROM jobs WHERE id = ? AND state != 'done'",
+                (chat_id, message_id, user_id, job_id)
+            )
+            return cursor.rowcount == 1
+
+    def finish(self, job_id):
+        """Close a job to new followers and return their (chat_id, message_id, user_id) rows"""
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute("UPDATE jobs SET state = 'done', updated = ? WHERE id = ?", (time.time(), job_id))
+                rows = self.db.execute(
+                    "SELECT chat_id, message_id, user_id FROM followers WHERE job_id = ?", (job_id,)
+                ).fetchall()
+                self.db.execute("DELETE FROM followers WHERE job_id = ?", (job_id,))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return [(row["chat_id"], row["message_id"], row["user_id"]) for row in rows]
+
+    def waiting(self, stale_after):
+        """Jobs any worker may claim now"""
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT * FROM jobs WHERE {WAITING}", {"now": now, "stale": now - stale_after}
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def running(self):
+        """Jobs held under a live lease"""
+        with self.lock:
+            rows = self.db.execute(f"SELECT * FROM jobs WHERE {RUNNING}", {"now": time.time()}).fetchall()
+        return [dict(row) for row in rows]
+
+    def claim(self, worker, lease):
+        """Lease the next waiting job to a worker for lease seconds; return its row or None"""
+        now = time.time()
+        params = {"now": now, "stale": now - lease}
+        with self.lock:
+            # An immediate transaction keeps two processes from claiming the same job
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                waiting = self.db.execute(f"SELECT * FROM jobs WHERE {WAITING}", params).fetchall()
+                running = self.db.execute(f"SELECT user_id FROM jobs WHERE {RUNNING}", params).fetchall()
+                order = fair_order(waiting, running)
+                row = None
+                if order:
+                    self.db.execute(
+                        "UPDATE jobs SET worker = ?, lease_until = ?, attempts = attempts + 1, updated = ?,"
+                        " state = CASE WHEN state = 'uploading' THEN state ELSE 'running' END WHERE id = ?",
+                        (worker, now + lease, now, order[0]["id"])
+                    )
+                    row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (order[0]["id"],)).fetchone()
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return dict(row) if row else None
+
+    def renew(self, worker, job_ids, lease):
+        """Extend a worker's leases; return the ids it no longer holds"""
+        now = time.time()
+        lost = []
+        with self.lock:
+            for job_id in job_ids:
+                cursor = self.db.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ?", (now + lease, job_id, worker)
+                )
+                if cursor.rowcount != 1:
+                    lost.append(job_id)
+        return lost
+
+    def release(self, worker):
+        """Let other workers claim a stopping worker's jobs right away"""
+        # A clean stop is not the job's fault, so it doesn't use up an attempt
+        with self.lock:
+            self.db.execute(
+                f"UPDATE jobs SET lease_until = 0, attempts = attempts - 1 WHERE worker = :worker AND {RUNNING}",
+                {"worker": worker, "now": time.time()}
+            )
+
+    def unfinished(self):
+        """Return all jobs left over from a previous run, oldest first"""
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
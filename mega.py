@@ -0,0 +1,403 @@
+import os
+import re
+import json
+import time
+import base64
+import threading
+import requests
+from transport import session
+from metrics import download_throughput, transfer_errors
+from mega_api import api, MegaError
+import tracing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from Crypto.Cipher import AES
+
+# Configuration
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", "65536"))
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+DOWNLOAD_SEGMENT_MB = int(os.getenv("DOWNLOAD_SEGMENT_MB", "4"))
+RANGE_RETRIES = int(os.getenv("RANGE_RETRIES", "3"))
+
+class MacMismatch(Exception):
+    """Raised when decrypted data does not match the file's meta-MAC"""
+
+class DownloadAborted(Exception):
+    """Raised in a download's fetches once whoever reads it has given up"""
+
+def b64_decode(data):
+    """Decode Mega's unpadded URL-safe base64"""
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def xor_bytes(a, b):
+    """XOR two equal-length byte strings"""
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+def parse_mega_url(url):
+    """Split a Mega.nz file link into file ID and key bytes"""
+    # Extract file ID and key from URL
+    match = re.search(r'mega\.(nz|co)/file/([a-zA-Z0-9]+)#([a-zA-Z0-9_-]+)', url)
+    if not match:
+        raise ValueError("Invalid Mega URL format")
+    
+    file_id = match.group(2)
+    try:
+        file_key_bytes = b64_decode(match.group(3))
+    except ValueError:
+        raise ValueError("Invalid Mega key format")
+    if len(file_key_bytes) != 32:
+        raise ValueError("Invalid Mega key format")
+    return file_id, file_key_bytes
+
+def parse_folder_url(url):
+    """Split a Mega.nz folder link into folder ID and 16-byte share key"""
+    match = re.search(r'mega\.(nz|co)/folder/([a-zA-Z0-9]+)#([a-zA-Z0-9_-]+)', url)
+    if not match:
+        raise ValueError("Invalid Mega folder URL format")
+    
+    folder_id = match.group(2)
+    try:
+        folder_key = b64_decode(match.group(3))
+    except ValueError:
+        raise ValueError("Invalid Mega key format")
+    if len(folder_key) != 16:
+        raise ValueError("Invalid Mega key format")
+    return folder_id, folder_key
+
+def is_folder_url(url):
+    """Whether a Mega.nz link points at a folder"""
+    return bool(re.search(r'mega\.(nz|co)/folder/', url))
+
+def derive_file_key(file_key_bytes):
+    """Split a 32-byte Mega file key into AES key, CTR nonce and meta-MAC"""
+    aes_key = xor_bytes(file_key_bytes[:16], file_key_bytes[16:])
+    nonce = file_key_bytes[16:24]
+    meta_mac = file_key_bytes[24:32]
+    return aes_key, nonce, meta_mac
+
+def decrypt_attributes(at, aes_key):
+    """Decrypt a Mega node attribute blob into a dict"""
+    cipher = AES.new(aes_key, AES.MODE_CBC, iv=bytes(16))
+    decrypted = cipher.decrypt(b64_decode(at)).rstrip(b'\0')
+    if not decrypted.startswith(b'MEGA{'):
+        raise ValueError("Wrong Mega key for this file")
+    return json.loads(decrypted[4:].decode('utf-8', errors='replace'))
+
+def get_file_info(file_id):
+    """Fetch download URL and size for a public Mega file"""
+    data = api.file_info(file_id)
+    if "g" not in data:
+        transfer_errors.inc(phase="mega_api")
+        raise Exception(f"Failed to get download URL: {data}")
+    return data
+
+def folder_api(folder_id, payload):
+    """Run a batch of commands in the context of a public folder"""
+    return api.request(payload, node=folder_id, call="folder")
+
+def decrypt_node_key(k, folder_key):
+    """Decrypt a node's 'handle:key' entries with the folder key, returning candidates"""
+    ecb = AES.new(folder_key, AES.MODE_ECB)
+    candidates = []
+    for entry in k.split('/'):
+        _, _, enc_key = entry.partition(':')
+        raw = b64_decode(enc_key)
+        if raw and len(raw) % 16 == 0:
+            candidates.append(ecb.decrypt(raw))
+    return candidates
+
+def get_folder_files(folder_id, folder_key):
+    """List the files of a public folder with decrypted keys and names"""
+    data = folder_api(folder_id, [{"a": "f", "c": 1, "r": 1, "ca": 1}])[0]
+    if isinstance(data, int):
+        transfer_errors.inc(phase="mega_api")
+        raise MegaError(data)
+    
+    files = []
+    for node in data.get("f", []):
+        # Type 0 is a file; folders only matter for their children
+        if node.get("t") != 0 or "k" not in node:
+            continue
+        for key in decrypt_node_key(node["k"], folder_key):
+            if len(key) != 32:
+                continue
+            try:
+                attrs = decrypt_attributes(node["a"], derive_file_key(key)[0])
+            except ValueError:
+                continue
+            files.append({"handle": node["h"], "name": attrs.get("n") or node["h"], "size": node["s"], "key": key})
+            break
+    return files
+
+def get_folder_downloads(folder_id, handles):
+    """Fetch download URLs for many folder files in batched API calls"""
+    results = []
+    for i in range(0, len(handles), 100):
+        batch = handles[i:i + 100]
+        results.extend(folder_api(folder_id, [{"a": "g", "g": 1, "n": handle} for handle in batch]))
+    return results
+
+def mega_chunk_bounds(size):
+    """Yield (start, end) offsets of Mega's MAC chunks: 128 KiB growing to 1 MiB"""
+    start = 0
+    step = 1
+    while start < size:
+        end = min(start + step * 131072, size)
+        yield start, end
+        start = end
+        if step < 8:
+            step += 1
+
+def on_chunk_boundary(offset, size):
+    """Whether offset is the start of a Mega MAC chunk or the end of the file"""
+    if offset in (0, size):
+        return True
+    return any(start == offset for start, _ in mega_chunk_bounds(offset + 1))
+
+def plan_ranges(size, segment_size, offset=0):
+    """Group Mega chunks from offset on into download ranges of roughly segment_size bytes"""
+    ranges = []
+    range_start = offset
+    for _, end in mega_chunk_bounds(size):
+        if end <= offset:
+            continue
+        if end - range_start >= segment_size:
+            ranges.append((range_start, end))
+            range_start = end
+    if range_start < size:
+        ranges.append((range_start, size))
+    return ranges
+
+class MegaMac:
+    """Incremental Mega file MAC: CBC-MAC per chunk, chained over all chunks"""
+
+    def __init__(self, aes_key, nonce, size, offset=0, file_mac=None):
+        self.aes_key = aes_key
+        self.mac_iv = nonce + nonce
+        self.ecb = AES.new(aes_key, AES.MODE_ECB)
+        self.bounds = ((start, end) for start, end in mega_chunk_bounds(size) if start >= offset)
+        if not on_chunk_boundary(offset, size):
+            raise ValueError(f"Offset {offset} is not on a Mega chunk boundary")
+        self.size = size
+        self.position = offset
+        self.chunk_end = offset
+        self.cbc = None
+        self.last_block = None
+        self.tail = b''
+        self.file_mac = file_mac or bytes(16)
+        self.verified = (offset, self.file_mac)
+
+    def update(self, plain):
+        """Feed the next run of plaintext bytes"""
+        view = memoryview(plain)
+        while view:
+            if self.cbc is None:
+                if self.position >= self.size:
+                    raise IOError(f"Received more than the advertised {self.size} bytes")
+                _, self.chunk_end = next(self.bounds)
+                self.cbc = AES.new(self.aes_key, AES.MODE_CBC, iv=self.mac_iv)
+            take = min(len(view), self.chunk_end - self.position)
+            self._absorb(view[:take])
+            self.position += take
+            view = view[take:]
+            if self.position == self.chunk_end:
+                self._finish_chunk()
+
+    def _absorb(self, view):
+        if self.tail:
+            fill = min(16 - len(self.tail), len(view))
+            self.tail += bytes(view[:fill])
+            view = view[fill:]
+            if len(self.tail) < 16:
+                return
+            self.last_block = self.cbc.encrypt(self.tail)
+            self.tail = b''
+        aligned = len(view) - len(view) % 16
+        if aligned:
+            self.last_block = self.cbc.encrypt(view[:aligned])[-16:]
+        self.tail = bytes(view[aligned:])
+
+    def _finish_chunk(self):
+        if self.tail:
+            self.last_block = self.cbc.encrypt(self.tail.ljust(16, b'\0'))
+        self.file_mac = self.ecb.encrypt(xor_bytes(self.file_mac, self.last_block))
+        self.cbc = None
+        self.tail = b''
+        self.verified = (self.position, self.file_mac)
+
+    def condensed(self):
+        """Return the 8-byte meta-MAC Mega stores in the file key"""
+        if self.position != self.size:
+            raise IOError(f"Download ended after {self.position} of {self.size} bytes")
+        mac = self.file_mac
+        return xor_bytes(mac[0:4], mac[4:8]) + xor_bytes(mac[8:12], mac[12:16])
+
+class MegaDecryptor:
+    """Streaming AES-CTR decryption that verifies the meta-MAC as it goes"""
+
+    def __init__(self, aes_key, nonce, meta_mac, size, offset=0, file_mac=None):
+        # Chunk boundaries are 16-byte aligned, so the counter resumes exactly
+        self.ctr = AES.new(aes_key, AES.MODE_CTR, nonce=nonce, initial_value=offset // 16)
+        self.mac = MegaMac(aes_key, nonce, size, offset, file_mac)
+        self.meta_mac = meta_mac
+
+    def decrypt(self, data):
+        """Decrypt the next run of ciphertext and fold it into the MAC"""
+        plain = self.ctr.decrypt(data)
+        self.mac.update(plain)
+        return plain
+
+    def verify(self):
+        """Raise MacMismatch unless the whole file matched its meta-MAC"""
+        if self.mac.condensed() != self.meta_mac:
+            raise MacMismatch("Mega file failed integrity check (MAC mismatch)")
+
+class MegaStream:
+    """An open, decrypting Mega.nz download that can be iterated once"""
+
+    def __init__(self, name, size, offset, chunks, decryptor, aborted=None):
+        self.name = name
+        self.size = size
+        self.offset = offset
+        self.decryptor = decryptor
+        self.chunks = decrypt_stream(chunks, decryptor)
+        self.aborted = aborted or threading.Event()
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        """Stop the download and release its connections"""
+        self.aborted.set()
+        self.chunks.close()
+
+    def abort(self):
+        """Make in-flight fetches give up; safe to call from any thread while another reads"""
+        self.aborted.set()
+
+    def checkpoint(self):
+        """Return (offset, file MAC state) after the last completed MAC chunk"""
+        return self.decryptor.mac.verified
+
+def decrypt_stream(chunks, decryptor):
+    """Decrypt an iterator of ciphertext chunks, verifying the MAC at the end"""
+    started = time.time()
+    nbytes = 0
+    try:
+        for chunk in chunks:
+            nbytes += len(chunk)
+            yield decryptor.decrypt(chunk)
+        decryptor.verify()
+        download_throughput.observe(nbytes / max(time.time() - started, 0.001))
+    except Exception:
+        transfer_errors.inc(phase="download")
+        raise
+    finally:
+        chunks.close()
+
+def fetch_range(download_url, start, end, throttle=None, aborted=None):
+    """Download bytes [start, end) from a Mega storage URL, retrying on failure
+
+    Setting the aborted event stops the fetch at the next chunk.
+    """
+    aborted = aborted or threading.Event()
+    with tracing.span("download.range", bytes=end - start) as span:
+        for attempt in range(RANGE_RETRIES + 1):
+            span["retries"] = attempt
+            try:
+                with session.get(f"{download_url}/{start}-{end - 1}", stream=True, timeout=60) as response:
+                    response.raise_for_status()
+                    parts = []
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if aborted.is_set():
+                            raise DownloadAborted(f"Range {start}-{end - 1} aborted")
+                        if throttle:
+                            throttle(len(chunk))
+                        parts.append(chunk)
+                content = b''.join(parts)
+                if len(content) != end - start:
+                    raise IOError(f"Range {start}-{end - 1} returned {len(content)} bytes")
+                return content
+            except (requests.RequestException, IOError) as e:
+                if attempt == RANGE_RETRIES:
+                    raise
+                print(f"Retrying range {start}-{end - 1} after error: {str(e)}")
+                if aborted.wait(2 ** attempt):
+                    raise DownloadAborted(f"Range {start}-{end - 1} aborted")
+
+def iter_ranged(download_url, size, connections, offset=0, throttle=None, aborted=None):
+    """Fetch ranges concurrently and yield them in file order
+
+    Closing the generator, or setting aborted from another thread, stops the
+    fetches in flight without waiting for them.
+    """
+    aborted = aborted or threading.Event()
+    ranges = deque(plan_ranges(size, DOWNLOAD_SEGMENT_MB * 1024 * 1024, offset))
+    # Allow a little read-ahead so one slow range doesn't idle the others
+    window = connections * 2
+    executor = ThreadPoolExecutor(max_workers=connections)
+    pending = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < window:
+                start, end = ranges.popleft()
+                pending.append(executor.submit(tracing.bind(fetch_range), download_url, start, end, throttle, aborted))
+            yield pending.popleft().result()
+    finally:
+        aborted.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def resolve_file(url):
+    """Look up a file link: (name, key bytes, 'g' command response with size 's')"""
+    file_id, file_key_bytes = parse_mega_url(url)
+    data = get_file_info(file_id)
+    aes_key = derive_file_key(file_key_bytes)[0]
+    name = decrypt_attributes(data["at"], aes_key).get("n") or file_id
+    return name, file_key_bytes, data
+
+def mega_open(url, offset=0, file_mac=None):
+    """Open a decrypting download from Mega.nz, optionally resuming at a chunk boundary"""
+    return open_download(*resolve_file(url), offset, file_mac)
+
+def open_download(name, file_key_bytes, data, offset=0, file_mac=None, throttle=None):
+    """Start downloading a file given its key and the 'g' command's response"""
+    aes_key, nonce, meta_mac = derive_file_key(file_key_bytes)
+    download_url = data["g"]
+    file_size = data["s"]
+    print(f"Downloading {file_size - offset} of {file_size} bytes from {download_url}...")
+    
+    decryptor = MegaDecryptor(aes_key, nonce, meta_mac, file_size, offset, file_mac)
+    aborted = threading.Event()
+    if DOWNLOAD_CONNECTIONS > 1 and file_size - offset > DOWNLOAD_SEGMENT_MB * 1024 * 1024:
+        chunks = iter_ranged(download_url, file_size, DOWNLOAD_CONNECTIONS, offset, throttle, aborted)
+        return MegaStream(name, file_size, offset, chunks, decryptor, aborted)
+    
+    if offset:
+        download_url = f"{download_url}/{offset}-{file_size - 1}"
+    with tracing.span("download.open"):
+        response = session.get(download_url, stream=True, timeout=60)
+        response.raise_for_status()
+    
+    def chunks():
+        try:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if aborted.is_set():
+                    raise DownloadAborted("Download aborted")
+                if chunk:
+                    if throttle:
+                        throttle(len(chunk))
+                    yield chunk
+        finally:
+            response.close()
+    
+    return MegaStream(name, file_size, offset, chunks(), decryptor, aborted)
+
+def mega_download_url(url, output_path):
+    """Download and decrypt a file from Mega.nz without mega.py dependency"""
+    stream = mega_open(url)
+    
+    with open(output_path, 'wb') as f:
+        for chunk in stream:
+            f.write(chunk)
+    
+    return output_path
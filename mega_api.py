@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import random
+import itertools
+import threading
+from concurrent.futures import Future
+import requests
+from transport import session
+from metrics import mega_api_seconds, transfer_errors
+import tracing
+
+# Configuration
+MEGA_API_URL = os.getenv("MEGA_API_URL", "https://g.api.mega.co.nz")
+MEGA_API_RETRIES = int(os.getenv("MEGA_API_RETRIES", "6"))
+MEGA_API_BACKOFF = float(os.getenv("MEGA_API_BACKOFF", "0.5"))
+MEGA_API_MAX_BACKOFF = float(os.getenv("MEGA_API_MAX_BACKOFF", "30"))
+MEGA_BATCH_WINDOW_MS = int(os.getenv("MEGA_BATCH_WINDOW_MS", "20"))
+MEGA_BATCH_SIZE = int(os.getenv("MEGA_BATCH_SIZE", "50"))
+MEGA_INFO_TTL = int(os.getenv("MEGA_INFO_TTL", "60"))
+
+ERROR_NAMES = {
+    -1: "internal error",
+    -2: "bad arguments",
+    -3: "try again",
+    -4: "rate limited",
+    -5: "failed",
+    -6: "too many requests",
+    -8: "link expired",
+    -9: "file not found",
+    -11: "access denied",
+    -16: "file taken down",
+    -17: "over transfer quota",
+    -18: "temporarily unavailable",
+}
+# EAGAIN, ERATELIMIT and ETEMPUNAVAIL clear up on their own
+RETRYABLE = {-3, -4, -18}
+
+class MegaError(Exception):
+    """A numeric error code returned by the Mega API"""
+
+    def __init__(self, code):
+        self.code = code
+        super().__init__(f"Mega API error {code} ({ERROR_NAMES.get(code, 'unknown')})")
+
+def backoff(attempt):
+    """Jittered exponential delay before retry number attempt"""
+    return min(MEGA_API_MAX_BACKOFF, MEGA_API_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+class MegaApi:
+    """Mega 'cs' client that batches concurrent file lookups into one request"""
+
+    def __init__(self):
+        self.seq = itertools.count(random.randint(0, 0xFFFFFFFF))
+        self.cond = threading.Condition()
+        self.queue = []
+        self.waiting = {}
+        self.info = {}
+        self.thread = None
+
+    def request(self, commands, node=None, call="batch"):
+        """Run a list of commands and return their results, retrying retryable errors
+
+        node selects a public folder's context. Commands that still fail with a
+        retryable code after all retries come back as that code.
+        """
+        with tracing.span("mega.cs", call=call, commands=len(commands)) as span:
+            return self._request(commands, node, call, span)
+
+    def _request(self, commands, node, call, span):
+        results = [None] * len(commands)
+        todo = list(range(len(commands)))
+        for attempt in range(MEGA_API_RETRIES + 1):
+            span["retries"] = attempt
+            url = f"{MEGA_API_URL}/cs?id={next(self.seq)}" + (f"&n={node}" if node else "")
+            started = time.time()
+            try:
+                response = session.post(url, data=json.dumps([commands[i] for i in todo]), timeout=30)
+                response.raise_for_status()
+                answer = response.json()
+                if isinstance(answer, int):
+                    raise MegaError(answer)
+            except (requests.RequestException, ValueError, MegaError) as e:
+                retryable = not isinstance(e, MegaError) or e.code in RETRYABLE
+                if isinstance(e, requests.HTTPError) and e.response.status_code < 500:
+                    retryable = False
+                if not retryable or attempt == MEGA_API_RETRIES:
+                    transfer_errors.inc(phase="mega_api")
+                    raise
+                print(f"Mega API {call} failed, retrying: {str(e)}")
+                time.sleep(backoff(attempt))
+                continue
+            finally:
+                mega_api_seconds.observe(time.time() - started, call=call)
+
+            retry = []
+            for i, result in zip(todo, answer):
+                results[i] = result
+                if isinstance(result, int) and result in RETRYABLE:
+                    retry.append(i)
+            if not retry or attempt == MEGA_API_RETRIES:
+                break
+            todo = retry
+            time.sleep(backoff(attempt))
+        return results
+
+    def files_info(self, file_ids):
+        """The 'g' command's responses for many public files, as {file_id: response or MegaError}
+
+        Lookups queued together go out in one request, and concurrent callers
+        asking for the same file share it.
+        """
+        results = {}
+        pending = {}
+        with self.cond:
+            now = time.time()
+            for file_id in file_ids:
+                cached = self.info.get(file_id)
+                if cached and now - cached[0] < MEGA_INFO_TTL:
+                    results[file_id] = cached[1]
+                    continue
+                future = self.waiting.get(file_id)
+                if future is None:
+                    future = self.waiting[file_id] = Future()
+                    self.queue.append(file_id)
+                pending[file_id] = future
+            if pending:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="mega-api", daemon=True)
+                    self.thread.start()
+                self.cond.notify()
+        with tracing.span("mega.file_info", files=len(file_ids), cached=len(results)):
+            for file_id, future in pending.items():
+                try:
+                    result = future.result()
+                except Exception as e:
+                    results[file_id] = e
+                    continue
+                if isinstance(result, int):
+                    transfer_errors.inc(phase="mega_api")
+                    result = MegaError(result)
+                results[file_id] = result
+        return results
+
+    def file_info(self, file_id):
+        """The 'g' command's response for a public file"""
+        result = self.files_info([file_id])[file_id]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+            # Give concurrent lookups a moment to join the same request
+            time.sleep(MEGA_BATCH_WINDOW_MS / 1000)
+            with self.cond:
+                batch = self.queue[:MEGA_BATCH_SIZE]
+                del self.queue[:MEGA_BATCH_SIZE]
+            try:
+                results = self.request([{"a": "g", "g": 1, "p": file_id} for file_id in batch], call="file")
+                error = None
+            except Exception as e:
+                results = [None] * len(batch)
+                error = e
+            now = time.time()
+            with self.cond:
+                for file_id, result in zip(batch, results):
+                    future = self.waiting.pop(file_id)
+                    if error:
+                        future.set_exception(error)
+                        continue
+                    if isinstance(result, dict):
+                        self.info[file_id] = (now, result)
+                    future.set_result(result)
+                # Drop expired entries so the cache stays small
+                for file_id in [k for k, (at, _) in self.info.items() if now - at >= MEGA_INFO_TTL]:
+                    del self.info[file_id]
+
+api = MegaApi()
@@ -0,0 +1,175 @@
+import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configuration
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9200"))
+
+# Bucket bounds shared by the histograms below
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RATE_BUCKETS = tuple(mb * 1024 * 1024 for mb in (0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200))
+
+registry = []
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Metric:
+    """Base for metrics with an optional fixed set of label names"""
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + format_labels(self.labels, key), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name} {value}" for name, value in self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """A value set directly, or read from a function at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self.function = function
+        if not self.labels:
+            self.values[()] = 0
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count something as in progress for the duration of a with block"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        if self.function:
+            try:
+                return [(self.name, self.function())]
+            except Exception as e:
+                print(f"Metric {self.name} failed: {str(e)}")
+                return []
+        return super().samples()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # Per-bucket counts (not cumulative), then sum and count
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append((f"{self.name}_bucket" + format_labels(self.labels, key, [("le", bound)]), cumulative))
+                lines.append((f"{self.name}_bucket" + format_labels(self.labels, key, [("le", "+Inf")]), count))
+                lines.append((f"{self.name}_sum" + format_labels(self.labels, key), total))
+                lines.append((f"{self.name}_count" + format_labels(self.labels, key), count))
+        return lines
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port=METRICS_PORT):
+    """Serve /metrics from a background thread; port 0 disables it
+
+    A port already in use, e.g. by another worker process on the host, only
+    costs this process its exporter.
+    """
+    if not port:
+        return
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    except OSError as e:
+        print(f"Metrics disabled, can't listen on :{port}: {str(e)}")
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📊 Metrics on :{port}/metrics")
+
+# Transfer pipeline metrics
+mega_api_seconds = Histogram("mega_api_seconds", "Mega API request latency", ["call"])
+download_throughput = Histogram(
+    "download_throughput_bytes_per_second", "Mega download throughput per transfer", buckets=RATE_BUCKETS
+)
+upload_throughput = Histogram(
+    "upload_throughput_bytes_per_second", "GoFile upload throughput per attempt", ["outcome"], buckets=RATE_BUCKETS
+)
+queue_wait_seconds = Histogram("job_queue_wait_seconds", "Time jobs spend queued before a worker takes them")
+job_seconds = Histogram("job_duration_seconds", "End-to-end job time from request to result", ["outcome"])
+transfer_errors = Counter("transfer_errors_total", "Errors by pipeline phase", ["phase"])
+jobs_running = Gauge("jobs_running", "Jobs currently held by a worker thread")
+slots_in_use = Gauge("transfer_slots_in_use", "Download and upload slots currently held", ["kind"])
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# Configuration
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "120"))
+PROFILE_SECONDS = int(os.getenv("PROFILE_SECONDS", "30"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+running = threading.Lock()
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is being taken"""
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample(seconds, interval=PROFILE_INTERVAL_MS / 1000):
+    """Sample every thread's stack for a while; returns (stack counts, samples taken)
+
+    Stacks are root-first tuples of frame labels, headed by the thread's name.
+    """
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    if not running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already being taken")
+    try:
+        me = threading.get_ident()
+        counts = Counter()
+        taken = 0
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                counts[tuple(reversed(stack))] += 1
+            taken += 1
+            time.sleep(interval)
+        return counts, taken
+    finally:
+        running.release()
+
+def folded(counts):
+    """Render stack counts in the folded format flamegraph.pl and speedscope read"""
+    return "".join(
+        ";".join(label.replace(";", ":") for label in stack) + f" {count}\n"
+        for stack, count in sorted(counts.items())
+    )
+
+def profile_to_file(seconds=PROFILE_SECONDS, name="worker"):
+    """Take a profile and write it under PROFILE_DIR; returns the path"""
+    counts, taken = sample(seconds)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"profile-{name}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+    with open(path, "w") as f:
+        f.write(folded(counts))
+    print(f"🔥 Wrote {taken} samples to {path}")
+    return path
+
+def start_background(name="worker"):
+    """Take a profile to file without blocking the caller, e.g. from a signal handler"""
+    def run():
+        try:
+            profile_to_file(name=name)
+        except Exception as e:
+            print(f"Profiling failed: {str(e)}")
+    threading.Thread(target=run, name="profiler", daemon=True).start()
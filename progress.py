@@ -0,0 +1,221 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Configuration
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "5"))
+PROGRESS_EDITS_PER_SECOND = float(os.getenv("PROGRESS_EDITS_PER_SECOND", "20"))
+
+PHASE_LABELS = (("download", "📥 Download"), ("upload", "📤 Upload"))
+
+def format_duration(seconds):
+    """Format seconds as a short 1h02m / 3m05s / 12s string"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class Phase:
+    """Byte counter for one phase with a sliding-window throughput estimate"""
+
+    def __init__(self):
+        self.total = None
+        self.done = 0
+        self.samples = deque(maxlen=20)
+        self.started = None
+        self.finished = None
+
+    def rate(self, now):
+        """Bytes per second over the last few samples"""
+        self.samples.append((now, self.done))
+        first_time, first_done = self.samples[0]
+        while len(self.samples) > 2 and now - self.samples[1][0] > 10:
+            self.samples.popleft()
+            first_time, first_done = self.samples[0]
+        if now - first_time < 0.5:
+            return 0
+        return max(0, self.done - first_done) / (now - first_time)
+
+    def elapsed(self):
+        """Seconds between the first and the last byte counted"""
+        if self.started is None:
+            return 0
+        return self.finished - self.started
+
+    def describe(self, now):
+        """One status line: percentage, MB/s and ETA"""
+        rate = self.rate(now)
+        if not self.total:
+            return "waiting"
+        if self.done >= self.total:
+            return "✅ done"
+        percent = self.done * 100 // self.total
+        text = f"{percent}% of {self.total / 1048576:.1f} MB"
+        if rate:
+            eta = (self.total - self.done) / rate
+            text += f" • {rate / 1048576:.1f} MB/s • ETA {format_duration(eta)}"
+        elif self.done:
+            text += " • stalled"
+        return text
+
+class JobProgress:
+    """Byte counts for one job, fed from the download and upload loops"""
+
+    def __init__(self, edit, chat_id, title="🔄 Processing your request..."):
+        self.edit = edit
+        self.chat_id = chat_id
+        self.title = title
+        self.phases = {name: Phase() for name, _ in PHASE_LABELS}
+        self.files = None
+        self.files_unit = "files"
+        self.dirty = True
+        self.last_text = None
+        self.lock = threading.Lock()
+        # Held while an edit is on the wire so the final message can't be overwritten
+        self.edit_lock = threading.Lock()
+        self.active = True
+
+    def set_total(self, total, done=0):
+        """Set the byte total for both phases unless it is already known"""
+        with self.lock:
+            for name, phase in self.phases.items():
+                if phase.total is None:
+                    phase.total = total
+                    phase.done = done if name == "download" else 0
+            self.dirty = True
+
+    def set_files(self, done, total, unit="files"):
+        """Show a files-done counter, for folder and batch jobs"""
+        with self.lock:
+            self.files = (done, total)
+            self.files_unit = unit
+            self.dirty = True
+
+    def add(self, phase, nbytes):
+        """Count bytes moved in a phase; cheap enough for every chunk"""
+        now = time.time()
+        with self.lock:
+            counter = self.phases[phase]
+            counter.done += nbytes
+            if counter.started is None:
+                counter.started = now
+            counter.finished = now
+            self.dirty = True
+
+    def summary(self):
+        """Bytes uploaded and time spent per phase, for the stats endpoint"""
+        with self.lock:
+            return {
+                "bytes": max(0, self.phases["upload"].done),
+                "download_seconds": round(self.phases["download"].elapsed(), 1),
+                "upload_seconds": round(self.phases["upload"].elapsed(), 1),
+            }
+
+    def snapshot(self):
+        """[done, total] bytes per phase and the files counter, for live status"""
+        with self.lock:
+            status = {name: [phase.done, phase.total] for name, phase in self.phases.items()}
+            status["files"] = self.files
+            return status
+
+    def attempt(self):
+        """A view whose counts can be undone if this transfer attempt fails"""
+        return ProgressAttempt(self)
+
+    def render(self):
+        """Build the status message text"""
+        now = time.time()
+        with self.lock:
+            lines = [self.title, ""]
+            if self.files:
+                lines.append(f"📁 {self.files[0]}/{self.files[1]} {self.files_unit} done")
+            for name, label in PHASE_LABELS:
+                lines.append(f"{label}: {self.phases[name].describe(now)}")
+            self.dirty = False
+        return "\n".join(lines)
+
+class ProgressAttempt:
+    """Forwards counts to a JobProgress and remembers them for undo()"""
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.counts = {}
+
+    def set_total(self, total, done=0):
+        self.parent.set_total(total, done)
+
+    def add(self, phase, nbytes):
+        self.counts[phase] = self.counts.get(phase, 0) + nbytes
+        self.parent.add(phase, nbytes)
+
+    def undo(self):
+        """Take back everything this attempt counted"""
+        for phase, nbytes in self.counts.items():
+            self.parent.add(phase, -nbytes)
+        self.counts = {}
+
+class ProgressReporter:
+    """One thread that turns job progress into throttled status message edits"""
+
+    def __init__(self, interval=PROGRESS_INTERVAL, edits_per_second=PROGRESS_EDITS_PER_SECOND):
+        self.interval = interval
+        self.edits_per_second = edits_per_second
+        self.tracked = []
+        self.chat_last_edit = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the reporting thread"""
+        threading.Thread(target=self._run, name="progress-reporter", daemon=True).start()
+
+    def track(self, progress):
+        """Begin reporting a job's progress"""
+        with self.lock:
+            self.tracked.append(progress)
+
+    def untrack(self, progress):
+        """Stop reporting, waiting out any edit already in flight"""
+        with self.lock:
+            if progress in self.tracked:
+                self.tracked.remove(progress)
+        with progress.edit_lock:
+            progress.active = False
+
+    def _run(self):
+        tokens = self.edits_per_second
+        last = time.time()
+        while True:
+            time.sleep(0.5)
+            now = time.time()
+            # Global token bucket keeps all jobs together under Telegram's limits
+            tokens = min(self.edits_per_second, tokens + (now - last) * self.edits_per_second)
+            last = now
+            with self.lock:
+                due = [p for p in self.tracked if p.dirty
+                       and now - self.chat_last_edit.get(p.chat_id, 0) >= self.interval]
+            # Chats waiting longest go first; one edit per chat per round
+            due.sort(key=lambda p: self.chat_last_edit.get(p.chat_id, 0))
+            edited_chats = set()
+            for progress in due:
+                if tokens < 1:
+                    break
+                if progress.chat_id in edited_chats:
+                    continue
+                edited_chats.add(progress.chat_id)
+                self.chat_last_edit[progress.chat_id] = now
+                tokens -= 1
+                self._edit(progress)
+
+    def _edit(self, progress):
+        text = progress.render()
+        with progress.edit_lock:
+            if not progress.active or text == progress.last_text:
+                return
+            try:
+                progress.edit(text)
+                progress.last_text = text
+            except Exception as e:
+                print(f"Error updating progress: {str(e)}")
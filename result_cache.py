@@ -0,0 +1,69 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from mega import parse_mega_url, parse_folder_url, is_folder_url
+
+# Configuration
+CACHE_TTL_DAYS = int(os.getenv("CACHE_TTL_DAYS", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+CACHE_CHECK_LIVENESS = os.getenv("CACHE_CHECK_LIVENESS", "False").lower() == "true"
+
+def cache_key(mega_url):
+    """Content address of a Mega file or folder: its handle plus its decryption key"""
+    if is_folder_url(mega_url):
+        node_id, key = parse_folder_url(mega_url)
+    else:
+        node_id, key = parse_mega_url(mega_url)
+    return hashlib.sha256(node_id.encode() + b":" + key).hexdigest()
+
+class ResultCache:
+    """Persistent LRU cache of GoFile results with GoFile's expiry as TTL"""
+
+    def __init__(self, path, ttl=CACHE_TTL_DAYS * 86400, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, download_page TEXT, code TEXT,"
+            " created REAL, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def get(self, key):
+        """Return a cached result dict, or None if missing or expired"""
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT * FROM results WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            if row["created"] + self.ttl < now:
+                self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+        return dict(row)
+
+    def put(self, key, download_page, code):
+        """Store a fresh result, evicting the least recently used entries"""
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (key, download_page, code, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, download_page, code, now, now)
+            )
+            self.db.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def invalidate(self, key):
+        """Drop a result whose GoFile link turned out to be gone"""
+        with self.lock:
+            self.db.execute("DELETE FROM results WHERE key = ?", (key,))
@@ -1,9 +1,14 @@
 import os
+import hmac
 import json
+import math
+import atexit
 import time
+import sqlite3
 import threading
+import requests
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
@@ -11,105 +16,360 @@ from flask_limiter.util import get_remote_address
 ADMIN_PANEL_PASSWORD = os.getenv("ADMIN_PANEL_PASSWORD", "admin123")
 ADMIN_FILE = "admins.txt"
 STATS_FILE = "bot_stats.json"
+STATE_DB = os.getenv("STATE_DB", "bot_state.db")
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "2"))
+STATS_TOKEN = os.getenv("STATS_TOKEN", "")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+WEBHOOK_FORWARD_URL = os.getenv("WEBHOOK_FORWARD_URL", "http://127.0.0.1:8443/telegram")
+LIVE_STALE_SECONDS = int(os.getenv("LIVE_STALE_SECONDS", "60"))
+TRACES_SHOWN = int(os.getenv("TRACES_SHOWN", "20"))
+API_CACHE_SECONDS = float(os.getenv("API_CACHE_SECONDS", "2"))
+SSE_INTERVAL = float(os.getenv("SSE_INTERVAL", "2"))
+SSE_MAX_SECONDS = int(os.getenv("SSE_MAX_SECONDS", "300"))
+# Each open stream holds a worker thread, so keep this below gunicorn's --threads
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "4"))
+SSE_RETRY_SECONDS = int(os.getenv("SSE_RETRY_SECONDS", "30"))
 
 # Global variables
 admin_ids = []
-stats = {
-    "total_conversions": 0,
-    "successful_conversions": 0,
-    "failed_conversions": 0,
-    "last_conversion": None,
-    "bot_uptime": time.time(),
-    "active_users": []
-}
-stats_lock = threading.Lock()
+admins_mtime = None
+stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 limiter = Limiter(
-    app,
-    key_func=get_remote_address,
+    get_remote_address,
+    app=app,
     default_limits=["5 per minute"]
 )
 
+COUNTERS = (
+    "total_conversions", "successful_conversions", "failed_conversions",
+    "cache_hits", "cache_misses", "bytes_transferred"
+)
+
+# Activity rings: bucket width in seconds and number of slots kept
+RINGS = {"minute": (60, 1440), "hour": (3600, 720), "day": (86400, 400)}
+ACTIVITY_FIELDS = ("conversions", "failures", "bytes", "download_seconds", "upload_seconds")
+
+class StatsStore:
+    """SQLite-backed stats with a cached read view and write-behind counter batches"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS active_users (user_id INTEGER PRIMARY KEY)")
+        # Latest queue and job progress report of each worker process
+        self.db.execute("CREATE TABLE IF NOT EXISTS live (worker TEXT PRIMARY KEY, data TEXT, updated REAL)")
+        for ring in RINGS:
+            # Fixed-size ring: slot = bucket % size, and a stale bucket in a slot is overwritten
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS activity_{ring} (slot INTEGER PRIMARY KEY, bucket INTEGER,"
+                " conversions INTEGER, failures INTEGER, bytes INTEGER,"
+                " download_seconds REAL, upload_seconds REAL)"
+            )
+        self._migrate()
+        self.pending = dict.fromkeys(COUNTERS, 0)
+        self.pending_meta = {}
+        self.pending_users = set()
+        self.pending_activity = {}
+        self.cache = None
+        self.data_version = None
+        self.flusher_pid = None
+
+    def _migrate(self):
+        """Seed counters, importing the old JSON stats file once"""
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                if self.db.execute("SELECT COUNT(*) FROM counters").fetchone()[0] == 0:
+                    saved = {}
+                    if os.path.exists(STATS_FILE):
+                        with open(STATS_FILE, 'r') as f:
+                            saved = json.load(f)
+                    for name in COUNTERS:
+                        self.db.execute("INSERT INTO counters VALUES (?, ?)", (name, int(saved.get(name, 0))))
+                    self.db.execute(
+                        "INSERT OR IGNORE INTO meta VALUES ('bot_uptime', ?)",
+                        (str(saved.get("bot_uptime", time.time())),)
+                    )
+                    if saved.get("last_conversion"):
+                        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('last_conversion', ?)", (saved["last_conversion"],))
+                    for user_id in saved.get("active_users", []):
+                        self.db.execute("INSERT OR IGNORE INTO active_users VALUES (?)", (user_id,))
+                # Counters added after the database was created
+                for name in COUNTERS:
+                    self.db.execute("INSERT OR IGNORE INTO counters VALUES (?, 0)", (name,))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def increment(self, name, amount=1):
+        """Queue a counter increment for the next batched flush"""
+        self._ensure_flusher()
+        with self.lock:
+            self.pending[name] += amount
+
+    def set_meta(self, key, value):
+        """Queue a metadata value such as last_conversion"""
+        self._ensure_flusher()
+        with self.lock:
+            self.pending_meta[key] = value
+
+    def add_active_user(self, user_id):
+        """Queue a user ID for the active users set"""
+        self._ensure_flusher()
+        with self.lock:
+            self.pending_users.add(user_id)
+
+    def record_activity(self, success, nbytes=0, download_seconds=0, upload_seconds=0, when=None):
+        """Queue one conversion for the per-minute activity buckets"""
+        self._ensure_flusher()
+        minute = int((when or time.time()) // 60)
+        with self.lock:
+            bucket = self.pending_activity.setdefault(minute, [0, 0, 0, 0.0, 0.0])
+            bucket[0] += 1
+            bucket[1] += 0 if success else 1
+            bucket[2] += nbytes
+            bucket[3] += download_seconds
+            bucket[4] += upload_seconds
+
+    def _ensure_flusher(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork
+        if self.flusher_pid != os.getpid():
+            self.flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(STATS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error saving stats: {str(e)}")
+
+    def flush(self):
+        """Apply queued changes in one transaction with atomic increments"""
+        self.apply([])
+
+    def apply(self, events):
+        """Write parsed events together with queued changes in one transaction
+
+        If the write fails nothing is counted, queued changes stay queued and
+        the events can be sent again.
+        """
+        with self.lock:
+            deltas = dict(self.pending)
+            meta = dict(self.pending_meta)
+            users = set(self.pending_users)
+            activity = {minute: list(values) for minute, values in self.pending_activity.items()}
+            for event in events:
+                deltas["total_conversions"] += 1
+                deltas["successful_conversions" if event["success"] else "failed_conversions"] += 1
+                if event["cache"] == "hit":
+                    deltas["cache_hits"] += 1
+                elif event["cache"] == "miss":
+                    deltas["cache_misses"] += 1
+                deltas["bytes_transferred"] += event["bytes"]
+                if event["user_id"] is not None:
+                    users.add(event["user_id"])
+                meta["last_conversion"] = datetime.fromtimestamp(event["time"]).isoformat()
+                bucket = activity.setdefault(int(event["time"] // 60), [0, 0, 0, 0.0, 0.0])
+                bucket[0] += 1
+                bucket[1] += 0 if event["success"] else 1
+                bucket[2] += event["bytes"]
+                bucket[3] += event["download_seconds"]
+                bucket[4] += event["upload_seconds"]
+            deltas = {name: amount for name, amount in deltas.items() if amount}
+            if not deltas and not meta and not users and not activity:
+                return
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for name, amount in deltas.items():
+                    self.db.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+                for key, value in meta.items():
+                    self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+                for user_id in users:
+                    self.db.execute("INSERT OR IGNORE INTO active_users VALUES (?)", (user_id,))
+                for minute, values in activity.items():
+                    self._write_activity(minute, values)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            self.pending = dict.fromkeys(COUNTERS, 0)
+            self.pending_meta = {}
+            self.pending_users = set()
+            self.pending_activity = {}
+            # Our own commit doesn't bump data_version, so drop the cache explicitly
+            self.cache = None
+
+    def _write_activity(self, minute, values):
+        """Add a minute's totals to every ring, rolling up to hours and days"""
+        for ring, (width, size) in RINGS.items():
+            bucket = minute * 60 // width
+            self.db.execute(
+                f"INSERT INTO activity_{ring} VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(slot) DO UPDATE SET"
+                " conversions = CASE WHEN bucket = excluded.bucket THEN conversions + excluded.conversions ELSE excluded.conversions END,"
+                " failures = CASE WHEN bucket = excluded.bucket THEN failures + excluded.failures ELSE excluded.failures END,"
+                " bytes = CASE WHEN bucket = excluded.bucket THEN bytes + excluded.bytes ELSE excluded.bytes END,"
+                " download_seconds = CASE WHEN bucket = excluded.bucket THEN download_seconds + excluded.download_seconds ELSE excluded.download_seconds END,"
+                " upload_seconds = CASE WHEN bucket = excluded.bucket THEN upload_seconds + excluded.upload_seconds ELSE excluded.upload_seconds END,"
+                " bucket = excluded.bucket"
+                " WHERE excluded.bucket >= bucket",
+                (bucket % size, bucket, *values)
+            )
+
+    def activity(self, ring, count):
+        """Last count buckets of a ring, oldest first, with missing buckets as zeros"""
+        width, size = RINGS[ring]
+        last = int(time.time() // width)
+        first = last - min(count, size) + 1
+        series = {bucket: [0, 0, 0, 0.0, 0.0] for bucket in range(first, last + 1)}
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT bucket, {', '.join(ACTIVITY_FIELDS)} FROM activity_{ring} WHERE bucket >= ?",
+                (first,)
+            ).fetchall()
+            pending = list(self.pending_activity.items())
+        for bucket, *values in rows:
+            if bucket in series:
+                series[bucket] = list(values)
+        for minute, values in pending:
+            bucket = minute * 60 // width
+            if bucket in series:
+                series[bucket] = [a + b for a, b in zip(series[bucket], values)]
+        
+        result = {"buckets": [bucket * width for bucket in series]}
+        for i, field in enumerate(ACTIVITY_FIELDS):
+            result[field] = [values[i] for values in series.values()]
+        return result
+
+    def set_live(self, worker, data):
+        """Store a worker's live report; written right away, as it replaces the last one"""
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO live VALUES (?, ?, ?)", (worker, json.dumps(data), time.time()))
+
+    def live(self):
+        """Queue depth and running jobs from workers that reported recently"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT data FROM live WHERE updated >= ? ORDER BY worker", (time.time() - LIVE_STALE_SECONDS,)
+            ).fetchall()
+        reports = [json.loads(data) for data, in rows]
+        return {
+            "workers": len(reports),
+            # Shared-queue processes all report the same queue, so don't add them up
+            "queued": max((report.get("queued", 0) for report in reports), default=0),
+            "jobs": sorted((job for report in reports for job in report.get("jobs", [])), key=lambda job: job["id"]),
+            "traces": sorted(
+                ({**trace, "worker": report["worker"]} for report in reports for trace in report.get("traces", [])),
+                key=lambda trace: trace["started"], reverse=True
+            )[:TRACES_SHOWN],
+        }
+
+    def snapshot(self):
+        """Current stats; the database is only read again after another process writes"""
+        with self.lock:
+            version = self.db.execute("PRAGMA data_version").fetchone()[0]
+            if self.cache is None or version != self.data_version:
+                cache = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+                meta = dict(self.db.execute("SELECT key, value FROM meta").fetchall())
+                cache["last_conversion"] = meta.get("last_conversion")
+                cache["bot_uptime"] = float(meta.get("bot_uptime", time.time()))
+                cache["active_users"] = {row[0] for row in self.db.execute("SELECT user_id FROM active_users")}
+                self.cache = cache
+                self.data_version = version
+            result = dict(self.cache)
+            # Fold in changes that haven't been flushed yet
+            for name, amount in self.pending.items():
+                result[name] = result.get(name, 0) + amount
+            if "last_conversion" in self.pending_meta:
+                result["last_conversion"] = self.pending_meta["last_conversion"]
+            result["active_users"] = result["active_users"] | self.pending_users
+            return result
+
+store = StatsStore(STATE_DB)
+# Don't lose the last batch of increments on shutdown
+atexit.register(store.flush)
+# Keep-alive connection to the worker's update listener
+forwarder = requests.Session()
+
 def load_admins():
-    """Load admin IDs from file"""
-    global admin_ids
+    """Load admin IDs from file when it has changed since the last load"""
+    global admin_ids, admins_mtime
     try:
         if os.path.exists(ADMIN_FILE):
+            mtime = os.path.getmtime(ADMIN_FILE)
+            if mtime == admins_mtime:
+                return
             with open(ADMIN_FILE, 'r') as f:
                 admin_ids = [int(line.strip()) for line in f if line.strip().isdigit()]
+            admins_mtime = mtime
     except Exception as e:
         print(f"Error loading admins: {str(e)}")
 
 def save_admins():
     """Save admin IDs to file"""
+    global admins_mtime
     try:
         with open(ADMIN_FILE, 'w') as f:
             for admin_id in admin_ids:
                 f.write(f"{admin_id}\n")
+        admins_mtime = os.path.getmtime(ADMIN_FILE)
     except Exception as e:
         print(f"Error saving admins: {str(e)}")
 
-def load_stats():
-    """Load bot statistics from file"""
-    global stats
-    try:
-        if os.path.exists(STATS_FILE):
-            with open(STATS_FILE, 'r') as f:
-                saved_stats = json.load(f)
-                # Only update existing keys to avoid losing in-memory data
-                for key in stats.keys():
-                    if key in saved_stats:
-                        stats[key] = saved_stats[key]
-                
-                # Convert active_users from list back to set
-                if isinstance(stats.get("active_users"), list):
-                    stats["active_users"] = set(stats["active_users"])
-    except Exception as e:
-        print(f"Error loading stats: {str(e)}")
-
-def save_stats():
-    """Save bot statistics to file"""
-    try:
-        with stats_lock:
-            # Convert set to list for JSON serialization
-            active_users = list(stats["active_users"])
-            stats_to_save = {**stats, "active_users": active_users}
-            
-            with open(STATS_FILE, 'w') as f:
-                json.dump(stats_to_save, f, indent=2)
-    except Exception as e:
-        print(f"Error saving stats: {str(e)}")
-
-def get_uptime():
+def get_uptime(stats):
     """Get formatted bot uptime"""
     uptime_seconds = time.time() - stats["bot_uptime"]
     return str(timedelta(seconds=int(uptime_seconds))).split('.')[0]
 
-def get_hourly_activity():
-    """Generate hourly activity data for the chart"""
-    now = datetime.now()
-    hours = []
-    counts = []
-    
-    # Generate last 24 hours
-    for i in range(23, -1, -1):
-        hour = now - timedelta(hours=i)
-        hours.append(hour.strftime("%H:00"))
-        # Count conversions in this hour (simplified for demo)
-        counts.append(min(5, stats["total_conversions"] // 24))  # Demo data
-    
-    return hours, counts
+def get_activity():
+    """Chart data for the last 24 hours, 7 days and 30 days from the activity rings"""
+    views = {
+        "24h": ("hour", 24, "%H:00"),
+        "7d": ("hour", 24 * 7, "%a %H:00"),
+        "30d": ("day", 30, "%b %d"),
+    }
+    activity = {}
+    for name, (ring, count, label_format) in views.items():
+        data = store.activity(ring, count)
+        data["labels"] = [datetime.fromtimestamp(ts).strftime(label_format) for ts in data.pop("buckets")]
+        activity[name] = data
+    return activity
+
+def dashboard_data():
+    """Counters and live job status shown on the dashboard"""
+    stats = store.snapshot()
+    return {
+        "counters": {name: stats[name] for name in COUNTERS},
+        "active_users": len(stats["active_users"]),
+        "last_conversion": stats["last_conversion"],
+        "started": stats["bot_uptime"],
+        "live": store.live(),
+    }
+
+# Last /api/stats body, shared by requests that arrive close together
+api_cache = {"at": 0, "body": None}
+api_cache_lock = threading.Lock()
+
+def api_body():
+    with api_cache_lock:
+        if api_cache["body"] is None or time.time() - api_cache["at"] >= API_CACHE_SECONDS:
+            api_cache["body"] = json.dumps({**dashboard_data(), "activity": get_activity()}, sort_keys=True)
+            api_cache["at"] = time.time()
+        return api_cache["body"]
 
 @app.before_request
 def before_request():
-    """Load data before each request"""
+    """Pick up admin changes made by other workers; stats are read on demand"""
     load_admins()
-    load_stats()
-    
-    # Ensure active_users is a set
-    if not isinstance(stats["active_users"], set):
-        stats["active_users"] = set(stats["active_users"])
 
 # Flask Admin Panel Routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -129,21 +389,21 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/dashboard')
+@limiter.exempt
 def dashboard():
     if not session.get('logged_in'):
         return redirect(url_for('login'))
     
-    # Get hourly activity data
-    hourly_labels, hourly_data = get_hourly_activity()
+    stats = store.snapshot()
     
     return render_template(
         'dashboard.html',
         stats=stats,
         admins=admin_ids,
-        uptime=get_uptime(),
+        uptime=get_uptime(stats),
         current_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        hourly_labels=json.dumps(hourly_labels),
-        hourly_data=json.dumps(hourly_data)
+        activity=json.dumps(get_activity()),
+        stream_retry_ms=SSE_RETRY_SECONDS * 1000
     )
 
 @app.route('/add_admin', methods=['POST'])
@@ -178,33 +438,218 @@ def remove_admin():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 400
 
+def parse_event(data):
+    """Check one conversion event from the worker; raises ValueError if it is malformed"""
+    if not isinstance(data, dict):
+        raise ValueError("Each event must be an object")
+    try:
+        event = {
+            "success": bool(data.get('success', True)),
+            "cache": data.get('cache'),
+            "time": float(data.get('time') or time.time()),
+            "bytes": int(data.get('bytes', 0)),
+            "download_seconds": float(data.get('download_seconds', 0)),
+            "upload_seconds": float(data.get('upload_seconds', 0)),
+            "user_id": None if data.get('user_id') is None else int(data['user_id']),
+        }
+        datetime.fromtimestamp(event["time"])
+    except (TypeError, ValueError, OverflowError, OSError) as e:
+        raise ValueError(f"Malformed event {json.dumps(data)[:200]}: {str(e)}")
+    if not all(math.isfinite(event[name]) for name in ("download_seconds", "upload_seconds")):
+        raise ValueError(f"Malformed event {json.dumps(data)[:200]}: durations must be finite")
+    return event
+
+def parse_events(data):
+    """Check a whole batch before any of it is counted"""
+    if not isinstance(data, dict) or not isinstance(data.get('events'), list):
+        raise ValueError("Expected {\"events\": [...]}")
+    return [parse_event(event) for event in data['events']]
+
+def viewer_authorized():
+    """Logged-in panel users, or scripts holding STATS_TOKEN"""
+    return bool(session.get('logged_in')) or (bool(STATS_TOKEN) and worker_authorized())
+
+@app.route('/api/stats')
+@limiter.exempt
+def api_stats():
+    """Dashboard data as JSON; unchanged data answers If-None-Match with 304"""
+    if not viewer_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    response = Response(api_body(), mimetype='application/json')
+    response.add_etag()
+    # Browsers revalidate with the ETag instead of reusing a stale copy
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/stream')
+@limiter.exempt
+def api_stream():
+    """Server-sent events: a snapshot, then counter deltas and live job status as they change"""
+    if not viewer_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    if not stream_slots.acquire(blocking=False):
+        # Leaves threads free for workers and logins; the dashboard retries later
+        return Response(
+            f"retry: {SSE_RETRY_SECONDS * 1000}\n\n", status=503, mimetype='text/event-stream',
+            headers={'Retry-After': str(SSE_RETRY_SECONDS), 'Cache-Control': 'no-cache'}
+        )
+    
+    def events():
+        # Browsers reconnect on their own, so streams end rather than hold a thread forever
+        deadline = time.time() + SSE_MAX_SECONDS
+        previous = None
+        last_sent = time.time()
+        yield "retry: 3000\n\n"
+        while time.time() < deadline:
+            data = dashboard_data()
+            if previous is None:
+                yield sse("snapshot", data)
+                last_sent = time.time()
+            else:
+                delta = {
+                    name: data["counters"][name] - previous["counters"][name]
+                    for name in COUNTERS if data["counters"][name] != previous["counters"][name]
+                }
+                changed = {key: data[key] for key in ("active_users", "last_conversion", "started") if data[key] != previous[key]}
+                if delta or changed:
+                    yield sse("delta", {"counters": delta, **changed})
+                    last_sent = time.time()
+                if data["live"] != previous["live"]:
+                    yield sse("live", data["live"])
+                    last_sent = time.time()
+            if time.time() - last_sent >= 15:
+                # Keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            previous = data
+            time.sleep(SSE_INTERVAL)
+    
+    response = Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the stream ends or the client goes away, even before the first event
+    response.call_on_close(stream_slots.release)
+    return response
+
+@app.route('/stats/live', methods=['POST'])
+@limiter.exempt
+def update_live():
+    """A worker's queue depth and in-flight job progress"""
+    if not worker_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get("worker"):
+        return jsonify({"error": "Expected a live report"}), 400
+    store.set_live(str(data["worker"]), data)
+    return jsonify({"success": True})
+
+def worker_authorized():
+    """Worker calls carry the shared STATS_TOKEN; without one, fall back to the panel login"""
+    if STATS_TOKEN:
+        sent = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        return hmac.compare_digest(sent, STATS_TOKEN)
+    return bool(session.get('logged_in'))
+
 @app.route('/stats', methods=['POST'])
 def update_stats():
     """API endpoint for worker to update stats"""
-    if not session.get('logged_in'):
+    if not worker_authorized():
         return jsonify({"error": "Unauthorized"}), 401
     
     try:
-        data = request.get_json()
-        success = data.get('success', True)
-        
-        with stats_lock:
-            stats["total_conversions"] += 1
-            if success:
-                stats["successful_conversions"] += 1
-            else:
-                stats["failed_conversions"] += 1
-            stats["last_conversion"] = datetime.now().isoformat()
-            save_stats()
-            
+        event = parse_event(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        store.apply([event])
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/stats/batch', methods=['POST'])
+@limiter.exempt
+def update_stats_batch():
+    """Bulk ingest endpoint for the worker's stats spool"""
+    if not worker_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    # A malformed batch would fail the same way every time, so the worker drops it on a 400
+    try:
+        events = parse_events(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        # The worker drops its spooled copy on a 200, so the events must be on disk first
+        store.apply(events)
+        return jsonify({"success": True, "accepted": len(events)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/telegram/<secret>', methods=['POST'])
+@limiter.exempt
+def telegram_webhook(secret):
+    """Check an update from Telegram and forward it to the worker's listener"""
+    if not TELEGRAM_WEBHOOK_SECRET or not hmac.compare_digest(secret, TELEGRAM_WEBHOOK_SECRET):
+        return jsonify({"error": "Not found"}), 404
+    sent = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(sent, TELEGRAM_WEBHOOK_SECRET):
+        return jsonify({"error": "Unauthorized"}), 401
+    update = request.get_json(silent=True)
+    if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+        return jsonify({"error": "Not a Telegram update"}), 400
+    
+    try:
+        response = forwarder.post(
+            WEBHOOK_FORWARD_URL,
+            data=request.get_data(),
+            headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": TELEGRAM_WEBHOOK_SECRET},
+            timeout=5
+        )
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Could not forward update {update['update_id']}: {str(e)}")
+        # Telegram keeps the update and retries it while we answer with an error
+        return jsonify({"error": "Worker unavailable"}), 503
+    return jsonify({"ok": True})
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics():
+    """Conversion totals in the Prometheus text format, read from the shared store"""
+    if not worker_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    stats = store.snapshot()
+    last_hour = store.activity("minute", 60)
+    last_conversion = stats.get("last_conversion")
+    samples = [
+        ("conversions_total", "counter", "Conversions reported by the worker", [
+            ('{result="success"}', stats["successful_conversions"]),
+            ('{result="failure"}', stats["failed_conversions"]),
+        ]),
+        ("cache_lookups_total", "counter", "Result cache lookups", [
+            ('{result="hit"}', stats["cache_hits"]),
+            ('{result="miss"}', stats["cache_misses"]),
+        ]),
+        ("transferred_bytes_total", "counter", "Bytes uploaded to GoFile", [("", stats["bytes_transferred"])]),
+        ("active_users", "gauge", "Users who have converted at least one link", [("", len(stats["active_users"]))]),
+        ("conversions_last_hour", "gauge", "Conversions in the last 60 minutes", [("", sum(last_hour["conversions"]))]),
+        ("transferred_bytes_last_hour", "gauge", "Bytes uploaded in the last 60 minutes", [("", sum(last_hour["bytes"]))]),
+        ("last_conversion_timestamp_seconds", "gauge", "Time of the last reported conversion", [
+            ("", datetime.fromisoformat(last_conversion).timestamp() if last_conversion else 0),
+        ]),
+        ("start_time_seconds", "gauge", "When the bot first started", [("", stats["bot_uptime"])]),
+    ]
+    lines = []
+    for name, kind, help_text, values in samples:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{labels} {value}" for labels, value in values]
+    return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 if __name__ == '__main__':
     # Load initial data
     load_admins()
-    load_stats()
     
     # Start the Flask app
     port = int(os.environ.get('PORT', 5000))
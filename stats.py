@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import threading
+from transport import session
+
+# Configuration
+STATS_SPOOL_FILE = os.getenv("STATS_SPOOL_FILE", "stats.db")
+STATS_TOKEN = os.getenv("STATS_TOKEN", "")
+STATS_REPORT_INTERVAL = float(os.getenv("STATS_REPORT_INTERVAL", 5))
+STATS_BATCH_SIZE = int(os.getenv("STATS_BATCH_SIZE", 500))
+STATS_MAX_BACKOFF = float(os.getenv("STATS_MAX_BACKOFF", 300))
+LIVE_REPORT_INTERVAL = float(os.getenv("LIVE_REPORT_INTERVAL", 2))
+LIVE_KEEPALIVE = float(os.getenv("LIVE_KEEPALIVE", 20))
+
+class StatsAggregator:
+    """Spools stats events locally and ships them to the admin panel in batches"""
+
+    def __init__(self, url, path=STATS_SPOOL_FILE, interval=STATS_REPORT_INTERVAL):
+        self.url = url
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, event TEXT)")
+
+    def start(self):
+        """Start the background sender"""
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def record(self, success=True, cache=None, user_id=None, **activity):
+        """Queue one conversion outcome; never touches the network"""
+        event = {"success": success, "time": time.time()}
+        if cache:
+            event["cache"] = cache
+        if user_id is not None:
+            event["user_id"] = user_id
+        event.update(activity)
+        with self.lock:
+            self.db.execute("INSERT INTO events (event) VALUES (?)", (json.dumps(event),))
+
+    def pending(self):
+        """Number of events waiting to be sent"""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def send(self):
+        """Send spooled events oldest first; False if the panel could not take them"""
+        # Processes sharing the spool take turns, so no batch goes out twice
+        with open(self.path + ".lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            return self._send()
+
+    def _send(self):
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT id, event FROM events ORDER BY id LIMIT ?", (STATS_BATCH_SIZE,)
+                ).fetchall()
+            if not rows:
+                return True
+            headers = {"Authorization": f"Bearer {STATS_TOKEN}"} if STATS_TOKEN else {}
+            try:
+                response = session.post(
+                    f"{self.url}/stats/batch",
+                    json={"events": [json.loads(event) for _, event in rows]},
+                    headers=headers,
+                    timeout=10
+                )
+            except Exception as e:
+                print(f"Stats panel unreachable, {len(rows)} events kept: {str(e)}")
+                return False
+            if 400 <= response.status_code < 500 and response.status_code not in (401, 403, 408, 429):
+                # Sending a malformed batch again would fail the same way and hold up every later event
+                print(f"Stats panel refused batch ({response.status_code}), dropping {len(rows)} events: {response.text[:200]}")
+            elif response.status_code != 200:
+                print(f"Stats panel rejected batch ({response.status_code}): {response.text[:200]}")
+                return False
+            # Delivery is at-least-once: a lost response means the batch is sent again
+            with self.lock:
+                self.db.execute("DELETE FROM events WHERE id <= ?", (rows[-1][0],))
+            if len(rows) < STATS_BATCH_SIZE:
+                return True
+
+    def _run(self):
+        backoff = self.interval
+        while True:
+            time.sleep(backoff)
+            if self.send():
+                backoff = self.interval
+            else:
+                backoff = min(backoff * 2, STATS_MAX_BACKOFF)
+
+class LiveReporter:
+    """Sends the worker's queue depth and job progress to the admin panel when they change"""
+
+    def __init__(self, url, status, interval=LIVE_REPORT_INTERVAL):
+        self.url = url
+        # Callable returning the current report
+        self.status = status
+        self.interval = interval
+
+    def start(self):
+        """Start the background sender"""
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        last = None
+        last_sent = 0
+        failing = False
+        headers = {"Authorization": f"Bearer {STATS_TOKEN}"} if STATS_TOKEN else {}
+        while True:
+            time.sleep(self.interval)
+            try:
+                report = self.status()
+                # Unchanged reports only go out often enough to show the worker is alive
+                if report == last and time.time() - last_sent < LIVE_KEEPALIVE:
+                    continue
+                response = session.post(f"{self.url}/stats/live", json=report, headers=headers, timeout=5)
+                response.raise_for_status()
+                last = report
+                last_sent = time.time()
+                failing = False
+            except Exception as e:
+                if not failing:
+                    print(f"Live status not sent: {str(e)}")
+                failing = True
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Configuration
+TRACE_JOBS = int(os.getenv("TRACE_JOBS", "50"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "200"))
+# Newest traces sent to the admin panel with each live report
+TRACE_REPORT = int(os.getenv("TRACE_REPORT", "20"))
+
+# The trace of the job the current thread is working for
+current = contextvars.ContextVar("trace", default=None)
+
+# Most recent job traces, running ones included
+ring = deque(maxlen=TRACE_JOBS)
+ring_lock = threading.Lock()
+
+class Trace:
+    """Timed spans of one job, with per-span-name totals that survive the span cap"""
+
+    def __init__(self, job_id, user_id, kind, queued=None):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.kind = kind
+        self.started = time.time()
+        self.finished = None
+        self.attrs = {}
+        self.spans = []
+        self.dropped = 0
+        # name -> [count, seconds, bytes, errors]
+        self.totals = {}
+        self.lock = threading.Lock()
+        if queued is not None:
+            self.add("queue.wait", queued, self.started, {})
+
+    def add(self, name, start, end, attrs):
+        with self.lock:
+            total = self.totals.setdefault(name, [0, 0.0, 0, 0])
+            total[0] += 1
+            total[1] += end - start
+            total[2] += attrs.get("bytes", 0)
+            total[3] += 1 if "error" in attrs else 0
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append((name, start, end, attrs))
+            else:
+                self.dropped += 1
+
+    def summary(self):
+        """Job-level view: outcome, duration and time per span name"""
+        end = self.finished or time.time()
+        with self.lock:
+            totals = {
+                name: {"count": count, "seconds": round(seconds, 3), "bytes": nbytes, "errors": errors}
+                for name, (count, seconds, nbytes, errors) in self.totals.items()
+            }
+        return {
+            "job_id": self.job_id,
+            "user_id": self.user_id,
+            "kind": self.kind,
+            "started": self.started,
+            "seconds": round(end - self.started, 3),
+            "running": self.finished is None,
+            **self.attrs,
+            "totals": totals,
+        }
+
+    def to_dict(self):
+        """Summary plus every kept span, with times relative to the job's start"""
+        with self.lock:
+            spans = [
+                {"name": name, "start": round(start - self.started, 3), "seconds": round(end - start, 3), **attrs}
+                for name, start, end, attrs in self.spans
+            ]
+            dropped = self.dropped
+        return {**self.summary(), "spans": spans, "dropped": dropped}
+
+@contextmanager
+def job(job_id, user_id, kind, queued=None):
+    """Trace everything the current thread does for a job until the block ends"""
+    trace = Trace(job_id, user_id, kind, queued)
+    with ring_lock:
+        ring.append(trace)
+    token = current.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.finished = time.time()
+        current.reset(token)
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block as part of the current job's trace; yields attrs to add bytes or retries to"""
+    trace = current.get()
+    if trace is None:
+        yield attrs
+        return
+    started = time.time()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = str(e)[:200] or type(e).__name__
+        raise
+    finally:
+        trace.add(name, started, time.time(), attrs)
+
+def annotate(**attrs):
+    """Set job-level attributes, such as the outcome, on the current trace"""
+    trace = current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+def bind(func):
+    """Wrap func to run in the calling thread's trace, for work handed to other threads"""
+    context = contextvars.copy_context()
+    # A context can only be entered by one thread at a time, so each call gets a copy
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+def recent(limit=None):
+    """Summaries of the traces in the ring, newest first"""
+    with ring_lock:
+        traces = list(ring)[::-1][:limit]
+    return [trace.summary() for trace in traces]
+
+def find(job_id):
+    """The newest trace of a job, if it is still in the ring"""
+    with ring_lock:
+        for trace in reversed(ring):
+            if trace.job_id == job_id:
+                return trace
+    return None
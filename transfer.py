@@ -0,0 +1,427 @@
+import os
+import time
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from mega import (
+    resolve_file, open_download, is_folder_url, parse_folder_url, get_folder_files,
+    get_folder_downloads, MacMismatch
+)
+from gofile import upload_file, upload_stream, folder_fields
+from metrics import Gauge, slots_in_use
+from admission import TempBudget, format_size
+import tracing
+
+# Configuration
+STREAM_TRANSFERS = os.getenv("STREAM_TRANSFERS", "True").lower() == "true"
+STREAM_BUFFER_MB = int(os.getenv("STREAM_BUFFER_MB", "16"))
+MAX_DOWNLOADS = int(os.getenv("MAX_DOWNLOADS", "2"))
+MAX_UPLOADS = int(os.getenv("MAX_UPLOADS", "2"))
+PARTIAL_DIR = os.getenv("PARTIAL_DIR", "partials")
+CHECKPOINT_MB = int(os.getenv("CHECKPOINT_MB", "16"))
+FOLDER_CONCURRENCY = int(os.getenv("FOLDER_CONCURRENCY", "3"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "3"))
+
+# Concurrency limits shared by all jobs; a streamed job holds one of each
+download_slots = threading.BoundedSemaphore(MAX_DOWNLOADS)
+upload_slots = threading.BoundedSemaphore(MAX_UPLOADS)
+# Temporary download directories in use, for the temp disk gauge
+temp_dirs = set()
+
+class PipeClosed(Exception):
+    """Raised on the producer side when the consumer has gone away"""
+
+class ChunkPipe:
+    """Bounded in-memory byte buffer between one producer and one consumer thread"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.buffered = 0
+        self.chunks = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.aborted = False
+        self.error = None
+
+    def put(self, chunk):
+        """Append a chunk, blocking while the buffer is full"""
+        with self.cond:
+            # An oversized chunk is still admitted into an empty buffer
+            while self.buffered and self.buffered + len(chunk) > self.max_bytes and not self.aborted:
+                self.cond.wait()
+            if self.aborted:
+                raise PipeClosed("Upload side stopped reading")
+            self.chunks.append(chunk)
+            self.buffered += len(chunk)
+            self.cond.notify_all()
+
+    def close(self, error=None):
+        """Mark the end of the stream, optionally with a producer error"""
+        with self.cond:
+            self.closed = True
+            self.error = error
+            self.cond.notify_all()
+
+    def abort(self):
+        """Stop the producer when the consumer fails"""
+        with self.cond:
+            self.aborted = True
+            self.chunks.clear()
+            self.buffered = 0
+            self.cond.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self.cond:
+                while not self.chunks and not self.closed:
+                    self.cond.wait()
+                if self.chunks:
+                    chunk = self.chunks.popleft()
+                    self.buffered -= len(chunk)
+                    self.cond.notify_all()
+                elif self.error:
+                    raise self.error
+                else:
+                    return
+            yield chunk
+
+def stream_to_gofile(open_stream, fields=None, progress=None, shaper=None):
+    """Pipe a Mega.nz download straight into a GoFile.io upload"""
+    with download_slots, upload_slots, slots_in_use.track(kind="download"), slots_in_use.track(kind="upload"):
+        return _stream(open_stream(), fields, progress, shaper)
+
+def _stream(stream, fields, progress, shaper):
+    pipe = ChunkPipe(STREAM_BUFFER_MB * 1024 * 1024)
+    if progress:
+        progress.set_total(stream.size)
+    
+    def produce():
+        try:
+            with tracing.span("download", mode="stream", bytes=0) as span:
+                for chunk in stream:
+                    pipe.put(chunk)
+                    span["bytes"] += len(chunk)
+                    if progress:
+                        progress.add("download", len(chunk))
+            pipe.close()
+        except PipeClosed:
+            pass
+        except Exception as e:
+            pipe.close(error=e)
+        finally:
+            stream.close()
+    
+    producer = threading.Thread(target=tracing.bind(produce), daemon=True)
+    producer.start()
+    try:
+        return upload_stream(pipe, stream.name, stream.size, fields, upload_counter(progress), upload_throttle(shaper))
+    except Exception:
+        # Report the download-side failure rather than the aborted upload
+        if pipe.error:
+            raise pipe.error
+        raise
+    finally:
+        pipe.abort()
+        # Wakes a producer waiting on a range, so the join doesn't wait for in-flight downloads
+        stream.abort()
+        producer.join()
+
+def partial_path(job_id):
+    """Path of the partial download kept for a journaled job"""
+    return os.path.join(PARTIAL_DIR, f"job_{job_id}.part")
+
+def resumable_bytes(entry):
+    """Bytes of a journaled job already in its partial file; 0 if it has to start over"""
+    path = entry["partial_path"] if entry else None
+    if not path or not os.path.exists(path):
+        return 0
+    if entry["state"] == "uploading":
+        return entry["size"] or 0
+    return entry["bytes_done"] or 0
+
+def clean_partials(keep_ids, min_age=0):
+    """Delete partial downloads that no journaled job refers to
+
+    min_age spares recent files, which other processes sharing PARTIAL_DIR
+    may have started after keep_ids was read.
+    """
+    if not os.path.isdir(PARTIAL_DIR):
+        return
+    keep = {os.path.basename(partial_path(job_id)) for job_id in keep_ids}
+    for name in os.listdir(PARTIAL_DIR):
+        path = os.path.join(PARTIAL_DIR, name)
+        if name.endswith(".part") and name not in keep:
+            try:
+                if time.time() - os.path.getmtime(path) >= min_age:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def temp_disk_usage():
+    """Bytes held in partial downloads and temporary download files"""
+    total = 0
+    for directory in [PARTIAL_DIR, *list(temp_dirs)]:
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+Gauge("temp_disk_bytes", "Disk used by partial and temporary downloads", function=temp_disk_usage)
+
+# Disk space promised to transfers that download to a file before uploading
+temp_budget = TempBudget([PARTIAL_DIR, tempfile.gettempdir()], temp_disk_usage)
+Gauge("temp_reserved_bytes", "Temp disk space reserved by transfers", function=lambda: temp_budget.reserved)
+
+def upload_counter(progress):
+    """Callback counting uploaded bytes into progress, if there is one"""
+    if progress:
+        return lambda nbytes: progress.add("upload", nbytes)
+    return None
+
+def download_throttle(shaper):
+    """The shaper's download callback, if there is a shaper"""
+    return shaper.download if shaper else None
+
+def upload_throttle(shaper):
+    """The shaper's upload callback, if there is a shaper"""
+    return shaper.upload if shaper else None
+
+def download_to_file(open_stream, file_path, journal=None, job_id=None, progress=None):
+    """Download and decrypt to file_path, resuming from the journal if possible"""
+    entry = journal.get(job_id) if journal else None
+    offset = 0
+    file_mac = None
+    if entry and entry["bytes_done"] and os.path.exists(file_path):
+        offset = entry["bytes_done"]
+        file_mac = bytes.fromhex(entry["file_mac"])
+    
+    stream = open_stream(offset, file_mac)
+    if progress:
+        progress.set_total(stream.size, stream.offset)
+    if journal:
+        journal.update(job_id, name=stream.name, size=stream.size, partial_path=file_path)
+    
+    with open(file_path, 'r+b' if offset else 'wb') as f, \
+            tracing.span("download", mode="file", offset=offset, bytes=0, write_seconds=0.0, checkpoints=0) as span:
+        # Anything past the checkpoint was never folded into the MAC
+        f.truncate(offset)
+        f.seek(offset)
+        saved = offset
+        try:
+            for chunk in stream:
+                started = time.time()
+                f.write(chunk)
+                span["write_seconds"] += time.time() - started
+                span["bytes"] += len(chunk)
+                if progress:
+                    progress.add("download", len(chunk))
+                done, mac = stream.checkpoint()
+                if journal and done - saved >= CHECKPOINT_MB * 1024 * 1024:
+                    started = time.time()
+                    f.flush()
+                    os.fsync(f.fileno())
+                    journal.checkpoint(job_id, done, mac)
+                    span["write_seconds"] += time.time() - started
+                    span["checkpoints"] += 1
+                    saved = done
+        finally:
+            stream.close()
+    return stream.name, stream.size
+
+def file_to_gofile(open_stream, fields=None, progress=None, shaper=None):
+    """Download to a temporary directory, then upload the file"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        temp_dirs.add(tmpdir)
+        try:
+            file_path = os.path.join(tmpdir, "download")
+            with download_slots, slots_in_use.track(kind="download"):
+                filename, _ = download_to_file(open_stream, file_path, progress=progress)
+            with upload_slots, slots_in_use.track(kind="upload"):
+                return upload_file(file_path, filename, fields, upload_counter(progress), upload_throttle(shaper))
+        finally:
+            temp_dirs.discard(tmpdir)
+
+def journaled_file_to_gofile(open_stream, journal, job_id, progress=None, shaper=None):
+    """Download to a partial file that survives restarts, then upload it"""
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    file_path = partial_path(job_id)
+    try:
+        entry = journal.get(job_id)
+        if entry["state"] == "uploading" and os.path.exists(file_path):
+            filename = entry["name"]
+            if progress:
+                progress.set_total(entry["size"], entry["size"])
+        else:
+            with download_slots, slots_in_use.track(kind="download"):
+                filename, size = download_to_file(open_stream, file_path, journal, job_id, progress)
+            journal.update(job_id, state="uploading", bytes_done=size)
+        with upload_slots, slots_in_use.track(kind="upload"):
+            result = upload_file(file_path, filename, on_sent=upload_counter(progress), throttle=upload_throttle(shaper))
+    except Exception:
+        # The job is over; a restart (no exception) keeps the file for resuming
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    os.remove(file_path)
+    return result
+
+def transfer(open_stream, fields=None, journal=None, job_id=None, progress=None, size=None, shaper=None):
+    """Move one Mega.nz file to GoFile.io, streaming when possible
+
+    A job with a partial file from before a restart carries on from that file.
+    """
+    entry = journal.get(job_id) if journal else None
+    resuming = resumable_bytes(entry) > 0
+    reserved = False
+    if not STREAM_TRANSFERS and not resuming and size is not None:
+        reserved = temp_budget.try_reserve(size)
+        if not reserved:
+            print(f"No temp space for {format_size(size)} right now, streaming instead")
+    try:
+        if not resuming and (STREAM_TRANSFERS or (size is not None and not reserved)):
+            attempt = progress.attempt() if progress else None
+            try:
+                # A streamed upload can't be resumed, so a restart begins again
+                return stream_to_gofile(open_stream, fields, attempt, shaper)
+            except (ValueError, MacMismatch):
+                raise
+            except Exception as e:
+                if attempt:
+                    attempt.undo()
+                print(f"Streaming transfer failed, retrying via temp file: {str(e)}")
+                # Wait for room on disk rather than running out of it halfway through
+                if size is not None:
+                    with tracing.span("temp.reserve", bytes=size):
+                        reserved = temp_budget.reserve(size)
+                    if not reserved:
+                        raise Exception(
+                            f"Streaming failed ({str(e)}) and there is no room for a "
+                            f"{format_size(size)} temporary file"
+                        ) from e
+        attempt = progress.attempt() if progress else None
+        try:
+            if journal:
+                return journaled_file_to_gofile(open_stream, journal, job_id, attempt, shaper)
+            return file_to_gofile(open_stream, fields, attempt, shaper)
+        except Exception:
+            if attempt:
+                attempt.undo()
+            raise
+    finally:
+        if reserved:
+            temp_budget.release(size)
+        # Whichever path ran, the job is over and its old partial file is no use
+        if entry and entry["partial_path"] and os.path.exists(entry["partial_path"]):
+            os.remove(entry["partial_path"])
+
+def convert(mega_url, journal=None, job_id=None, progress=None, shaper=None, fields=None):
+    """Transfer a Mega.nz file to GoFile.io and return the upload data"""
+    name, file_key_bytes, data = resolve_file(mega_url)
+    
+    def open_stream(offset=0, file_mac=None):
+        return open_download(name, file_key_bytes, data, offset, file_mac, download_throttle(shaper))
+    return transfer(
+        open_stream, fields, journal, job_id, progress=progress, size=data["s"], shaper=shaper
+    )
+
+def convert_folder(mega_url, progress=None, shaper=None, fields=None, count_files=True):
+    """Transfer every file of a Mega.nz folder into one GoFile.io folder
+
+    With fields, the files go into that existing folder instead of a new one.
+    Without count_files, progress keeps the caller's counter, e.g. a batch's links.
+    """
+    folder_id, folder_key = parse_folder_url(mega_url)
+    files = get_folder_files(folder_id, folder_key)
+    if not files:
+        raise Exception("This Mega folder has no files")
+    # One batched call fetches every download URL up front
+    downloads = get_folder_downloads(folder_id, [f["handle"] for f in files])
+    
+    total_bytes = sum(f["size"] for f in files)
+    if progress:
+        progress.set_total(total_bytes)
+        if count_files:
+            progress.set_files(0, len(files))
+    done_files = []
+    failed = []
+    
+    def move(f, data, fields):
+        if isinstance(data, int) or "g" not in data:
+            raise Exception(f"Mega refused the download: {data}")
+        
+        def open_stream(offset=0, file_mac=None):
+            return open_download(f["name"], f["key"], data, offset, file_mac, download_throttle(shaper))
+        result = transfer(open_stream, fields, progress=progress, size=f["size"], shaper=shaper)
+        done_files.append(f["name"])
+        if progress and count_files:
+            progress.set_files(len(done_files), len(files))
+        return result
+    
+    # Upload the smallest file first: its response creates the GoFile folder
+    pending = sorted(zip(files, downloads), key=lambda pair: pair[0]["size"])
+    first = None
+    while pending and not first and not fields:
+        f, data = pending.pop(0)
+        try:
+            first = move(f, data, None)
+        except Exception as e:
+            print(f"Folder file {f['name']} failed: {str(e)}")
+            failed.append(f["name"])
+    if not first and not fields:
+        raise Exception(f"All {len(files)} files failed to transfer")
+    
+    fields = fields or folder_fields(first)
+    results = []
+    with ThreadPoolExecutor(max_workers=FOLDER_CONCURRENCY) as executor:
+        futures = [(f, executor.submit(tracing.bind(move), f, data, fields)) for f, data in pending]
+        for f, future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Folder file {f['name']} failed: {str(e)}")
+                failed.append(f["name"])
+    if not first and not results:
+        raise Exception(f"All {len(files)} files failed to transfer")
+    
+    return {**(first or results[0]), "files": len(files), "failed": failed}
+
+def convert_batch(urls, progress=None, shaper=None, single_folder=False):
+    """Transfer several Mega.nz links at once; returns {url: upload data or the exception}
+
+    With single_folder, everything goes into the GoFile folder that the first
+    successful link creates.
+    """
+    results = {}
+    lock = threading.Lock()
+    if progress:
+        progress.set_files(0, len(urls), "links")
+    
+    def move(url, fields):
+        try:
+            if is_folder_url(url):
+                data = convert_folder(url, progress, shaper, fields, count_files=False)
+            else:
+                data = convert(url, progress=progress, shaper=shaper, fields=fields)
+        except Exception as e:
+            print(f"Batch link {url} failed: {str(e)}")
+            data = e
+        with lock:
+            results[url] = data
+            if progress:
+                progress.set_files(len(results), len(urls), "links")
+        return data
+    
+    pending = list(urls)
+    fields = None
+    while single_folder and pending and not fields:
+        data = move(pending.pop(0), None)
+        if not isinstance(data, Exception):
+            fields = folder_fields(data)
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+        list(executor.map(tracing.bind(lambda url: move(url, fields)), pending))
+    return {url: results[url] for url in urls}
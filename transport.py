@@ -0,0 +1,19 @@
+import os
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configuration
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "32"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+
+def make_session():
+    """Create a session that keeps connections alive per host"""
+    new_session = requests.Session()
+    # pool_connections is the number of hosts cached; pool_maxsize the sockets kept per host
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE)
+    new_session.mount('https://', adapter)
+    new_session.mount('http://', adapter)
+    return new_session
+
+# Shared by every outgoing call so repeat requests skip the TCP+TLS handshake
+session = make_session()
@@ -0,0 +1,93 @@
+import os
+import hmac
+import json
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram import Update
+
+# Configuration
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN_HOST = os.getenv("WEBHOOK_LISTEN_HOST", "127.0.0.1")
+WEBHOOK_LISTEN_PORT = int(os.getenv("WEBHOOK_LISTEN_PORT", "8443"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class UpdateListener(BaseHTTPRequestHandler):
+    """Takes updates the web service forwards and puts them on the bot's update queue"""
+    application = None
+    loop = None
+    # Telegram resends an update whose delivery looked failed, so drop repeats
+    recent = deque(maxlen=1000)
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=b'{}'):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != "/telegram":
+            self.reply(404)
+            return
+        if not hmac.compare_digest(self.headers.get(SECRET_HEADER, ""), TELEGRAM_WEBHOOK_SECRET):
+            self.reply(401)
+            return
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            update_id = data["update_id"]
+        except (ValueError, KeyError, TypeError):
+            self.reply(400)
+            return
+        with self.lock:
+            if update_id in self.recent:
+                self.reply(200)
+                return
+            self.recent.append(update_id)
+        try:
+            update = Update.de_json(data, self.application.bot)
+            asyncio.run_coroutine_threadsafe(self.application.update_queue.put(update), self.loop).result(5)
+        except Exception as e:
+            print(f"Error queueing update {update_id}: {str(e)}")
+            with self.lock:
+                self.recent.remove(update_id)
+            self.reply(503)
+            return
+        self.reply(200)
+
+LOOPBACK = ("127.0.0.1", "localhost", "::1")
+
+def check_listener(panel_url):
+    """Refuse a listener the web service at panel_url has no way to reach"""
+    panel_host = urlsplit(panel_url).hostname or ""
+    if WEBHOOK_LISTEN_HOST in LOOPBACK and panel_host not in LOOPBACK:
+        raise RuntimeError(
+            f"The web service at {panel_url} runs on another host, so it can't forward updates to "
+            f"{WEBHOOK_LISTEN_HOST}:{WEBHOOK_LISTEN_PORT}. Set WEBHOOK_LISTEN_HOST=0.0.0.0 here and point "
+            "the web service's WEBHOOK_FORWARD_URL at this worker's private address"
+        )
+
+def start_listener(application, loop):
+    """Serve forwarded updates from a background thread; returns the server"""
+    UpdateListener.application = application
+    UpdateListener.loop = loop
+    server = ThreadingHTTPServer((WEBHOOK_LISTEN_HOST, WEBHOOK_LISTEN_PORT), UpdateListener)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📨 Taking forwarded updates on {WEBHOOK_LISTEN_HOST}:{WEBHOOK_LISTEN_PORT}/telegram")
+    return server
+
+async def register(bot):
+    """Point Telegram at the web service's webhook endpoint"""
+    await bot.set_webhook(
+        f"{WEBHOOK_URL.rstrip('/')}/telegram/{TELEGRAM_WEBHOOK_SECRET}",
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES
+    )
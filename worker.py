@@ -1,27 +1,70 @@
 import os
 import re
-import tempfile
-import requests
+import json
 import time
+import signal
+import asyncio
 import threading
-import base64
-import json
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext
-from telegram import Update, ParseMode
+import concurrent.futures
+import httpx
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.constants import ParseMode
+from telegram import Bot, Update
+from telegram.helpers import escape_markdown
+from transport import session
+from transfer import convert, convert_folder, convert_batch, clean_partials, resumable_bytes
+from progress import JobProgress, ProgressReporter, format_duration
+from mega import is_folder_url
+from jobs import (
+    Job, JobScheduler, SharedScheduler, QueueFull, job_from_row, WORKER_NAME, LEASE_SECONDS, JOB_MAX_ATTEMPTS
+)
+from journal import Journal
+from stats import StatsAggregator, LiveReporter
+from metrics import Gauge, job_seconds, start_server as start_metrics
+from gofile import link_alive
+from result_cache import ResultCache, cache_key, CACHE_CHECK_LIVENESS
+from admission import AdmissionError, advertised_sizes, batch_sizes, admit
+import bandwidth
+import webhook
+import tracing
+import profiler
 
 # Configuration
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ADMIN_FILE = "admins.txt"
 STATS_FILE = "bot_stats.json"
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "jobs.db")
+CACHE_FILE = os.getenv("CACHE_FILE", "cache.db")
 ADMIN_PANEL_URL = os.getenv("ADMIN_PANEL_URL", "http://localhost:5000")
 DOCUMENT_AS_FILE = os.getenv("DOCUMENT_AS_FILE", "True").lower() == "true"
 USE_THUMBNAIL = os.getenv("USE_THUMBNAIL", "True").lower() == "true"
+# "all" runs everything in one process; "bot" and "transfer" processes share the queue in JOURNAL_FILE
+WORKER_ROLE = os.getenv("WORKER_ROLE", "all").lower()
+SHARED_QUEUE = WORKER_ROLE in ("bot", "transfer")
+# "polling" asks Telegram for updates; "webhook" takes them from the web service
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling").lower()
+# Most links one /gofile command may carry, and the largest links file it reads
+BATCH_MAX_LINKS = int(os.getenv("BATCH_MAX_LINKS", "50"))
+BATCH_FILE_MAX_KB = int(os.getenv("BATCH_FILE_MAX_KB", "256"))
+
+MEGA_LINK = re.compile(r'https://mega\.(nz|co)/(file|folder)/[a-zA-Z0-9]+#[a-zA-Z0-9_-]+')
+# A batch is journaled as one job whose mega_url carries all of its links
+BATCH_PREFIX = "batch:"
 
 # Global variables
 admin_ids = []
 stats_lock = threading.Lock()
+journal = Journal(JOURNAL_FILE)
+result_cache = ResultCache(CACHE_FILE)
+stats = StatsAggregator(ADMIN_PANEL_URL)
+# Jobs currently queued or running, by cache key, so repeats can join them.
+# Only touched on the event loop, so it needs no lock.
+inflight = {}
+# The bot's event loop, for Telegram calls made from transfer threads
+loop = None
+telegram_bot = None
+# Async client for admin panel calls made from handlers
+panel = httpx.AsyncClient(timeout=5)
 
 def load_admins():
     """Load admin IDs from file"""
@@ -39,197 +82,713 @@ def is_admin(user_id: int) -> bool:
 
 def admin_only(func):
     """Decorator to restrict access to admins"""
-    def wrapper(update: Update, context: CallbackContext):
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not is_admin(update.effective_user.id):
-            update.message.reply_text(
+            await update.message.reply_text(
                 "❌ You are not authorized to use this bot.\n"
                 "Contact the bot owner to request access.",
                 parse_mode=ParseMode.MARKDOWN
             )
             return
-        return func(update, context)
+        return await func(update, context)
     return wrapper
 
-def update_stats(success=True):
-    """Update bot statistics via admin panel API"""
-    try:
-        response = requests.post(
-            f"{ADMIN_PANEL_URL}/stats",
-            json={"success": success},
-            timeout=5
+def update_stats(success=True, cache=None, activity=None, user_id=None):
+    """Queue a stats event for the admin panel; sent in the background"""
+    stats.record(success, cache, user_id, **(activity or {}))
+
+def on_loop(coro, timeout=60):
+    """Run a coroutine on the bot's event loop from a transfer thread and wait for it"""
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+class MessageRef:
+    """A sent message known only by chat and message id, editable from any process
+
+    Followers also carry the id of the user whose request the message answers.
+    """
+
+    def __init__(self, chat_id, message_id, user_id=None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.user_id = user_id
+
+    async def edit_text(self, text, **options):
+        return await telegram_bot.edit_message_text(
+            text, chat_id=self.chat_id, message_id=self.message_id, **options
         )
-        if response.status_code != 200:
-            print(f"Failed to update stats: {response.text}")
-    except Exception as e:
-        print(f"Error updating stats: {str(e)}")
-
-def decrypt_key(enc_key, shared_key):
-    """Decrypt Mega key using shared key"""
-    key = shared_key[:16]
-    iv = shared_key[16:32]
-    cipher = AES.new(key, AES.MODE_CBC, iv)
-    decrypted = cipher.decrypt(enc_key)
-    return unpad(decrypted, AES.block_size)
-
-def mega_download_url(url, output_path):
-    """Download file from Mega.nz without mega.py dependency"""
-    # Extract file ID and key from URL
-    match = re.search(r'mega\.(nz|co)/file/([a-zA-Z0-9]+)#([a-zA-Z0-9_-]+)', url)
-    if not match:
-        raise ValueError("Invalid Mega URL format")
-    
-    file_id = match.group(2)
-    key_str = match.group(3)
-    
-    # Parse the key string
-    parts = key_str.split('!')
-    if len(parts) < 2:
-        raise ValueError("Invalid Mega key format")
-    
-    file_key = parts[0]
-    shared_key = parts[1] if len(parts) > 1 else ""
-    
-    # Convert keys to bytes
-    file_key_bytes = base64.urlsafe_b64decode(file_key + '==')
-    shared_key_bytes = base64.urlsafe_b64decode(shared_key + '==') if shared_key else b''
-    
-    # Get file attributes
-    api_url = f"https://g.api.mega.co.nz/cs?id=1&n={file_id}"
-    payload = [{
-        "a": "g",
-        "g": "1",
-        "p": file_id
-    }]
-    
-    response = requests.post(api_url, data=json.dumps(payload))
-    response.raise_for_status()
-    
-    data = response.json()[0]
-    if "g" not in data:
-        raise Exception(f"Failed to get download URL: {data}")
-    
-    download_url = data["g"]
-    file_size = data["s"]
-    
-    # Download the file
-    print(f"Downloading {file_size} bytes from {download_url}...")
-    
-    response = requests.get(download_url, stream=True)
-    response.raise_for_status()
-    
-    with open(output_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-    
-    return output_path
+
+def find_running(key):
+    """The queued or running job for a cache key, if there is one"""
+    if SHARED_QUEUE:
+        row = journal.find(key)
+        return job_from_row(row) if row else None
+    return inflight.get(key)
+
+async def follow_shared(job, msg, user_id):
+    """Add msg to a shared-queue job's recipients, or answer it now if the job just ended"""
+    if journal.add_follower(job.id, msg.chat_id, msg.message_id, user_id):
+        return
+    cached = result_cache.get(job.cache_key)
+    update_stats(success=bool(cached), cache="joined", user_id=user_id)
+    if cached:
+        await msg.edit_text(
+            result_text(cached["download_page"], cached["code"]),
+            parse_mode=ParseMode.MARKDOWN,
+            disable_web_page_preview=True
+        )
+    else:
+        await msg.edit_text(f"❌ Job #{job.id} ended without a link. Send the link again to retry.")
 
 @admin_only
-def convert_mega_to_gofile(update: Update, context: CallbackContext):
+async def convert_mega_to_gofile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Converts Mega.nz link to GoFile.io link"""
     message = update.message
     user_id = update.effective_user.id
     
-    mega_url = ' '.join(context.args).strip() if context.args else None
+    # A links file sent with /gofile as its caption arrives without parsed args
+    words = list(context.args or []) if message.text else (message.caption or '').split()[1:]
+    single_folder = bool(words) and words[0].lower() == "folder"
+    if single_folder:
+        words = words[1:]
+    mega_url = ' '.join(words).strip() or None
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    
+    if document or len(MEGA_LINK.findall(mega_url or '')) > 1:
+        try:
+            links = await batch_links(mega_url or '', document)
+        except ValueError as e:
+            await message.reply_text(f"❌ {str(e)}")
+            update_stats(success=False, user_id=user_id)
+            return
+        if len(links) > 1:
+            await queue_batch(message, user_id, links, single_folder)
+            return
+        mega_url = links[0]
     
     if not mega_url:
-        message.reply_text(
+        await message.reply_text(
             "❌ Please provide a Mega.nz link after the command\n\n"
             "Example:\n`/gofile https://mega.nz/file/...`", 
             parse_mode=ParseMode.MARKDOWN
         )
-        update_stats(success=False)
+        update_stats(success=False, user_id=user_id)
         return
     
     # Validate Mega URL format
-    if not re.match(r'^https://mega\.(nz|co)/file/[a-zA-Z0-9]+#[a-zA-Z0-9_-]+$', mega_url):
-        message.reply_text(
+    if not MEGA_LINK.fullmatch(mega_url):
+        await message.reply_text(
             "❌ Invalid Mega.nz link format\n\n"
-            "Must be:\n`https://mega.nz/file/...#...`", 
+            "Must be:\n`https://mega.nz/file/...#...` or `https://mega.nz/folder/...#...`", 
             parse_mode=ParseMode.MARKDOWN
         )
-        update_stats(success=False)
+        update_stats(success=False, user_id=user_id)
         return
 
-    # Send initial processing message
-    status_msg = message.reply_text(
-        "🔄 Processing your request...\n\n"
-        "1️⃣ Downloading from Mega.nz", 
-        disable_notification=True
+    try:
+        key = cache_key(mega_url)
+    except ValueError as e:
+        await message.reply_text(f"❌ {str(e)}")
+        update_stats(success=False, user_id=user_id)
+        return
+    
+    # Serve repeated links from the cache without moving any bytes; folders can change
+    cached = None if is_folder_url(mega_url) else result_cache.get(key)
+    if cached and CACHE_CHECK_LIVENESS and not await asyncio.to_thread(link_alive, cached["code"]):
+        result_cache.invalidate(key)
+        cached = None
+    if cached:
+        await message.reply_text(
+            result_text(cached["download_page"], cached["code"]),
+            parse_mode=ParseMode.MARKDOWN,
+            disable_web_page_preview=True
+        )
+        update_stats(success=True, cache="hit", user_id=user_id)
+        return
+    
+    running = find_running(key)
+    size = 0
+    if not running:
+        # Check the advertised size before any bytes move, so oversized links fail right away
+        try:
+            sizes = await asyncio.to_thread(advertised_sizes, mega_url)
+            size = admit(sizes, user_reserved(user_id))
+        except AdmissionError as e:
+            await message.reply_text(f"❌ {str(e)}")
+            update_stats(success=False, user_id=user_id)
+            return
+        except Exception as e:
+            await message.reply_text(f"❌ Could not read this Mega link:\n\n`{str(e)}`", parse_mode=ParseMode.MARKDOWN)
+            update_stats(success=False, user_id=user_id)
+            return
+        # Someone may have queued the same link while we were asking Mega
+        running = find_running(key)
+    if running:
+        # Same file is already on its way; share that job's result
+        follower_msg = await message.reply_text(
+            f"🔗 This file is already being converted (job #{running.id}).\n"
+            "You'll get the link here as soon as it's done.",
+            disable_notification=True
+        )
+        # The request counts once the job's outcome reaches it
+        if SHARED_QUEUE:
+            await follow_shared(running, follower_msg, user_id)
+        elif running.result:
+            # It finished while we were replying
+            text, options = running.result
+            update_stats(success=running.success, cache="joined", user_id=user_id)
+            await follower_msg.edit_text(text, **options)
+        else:
+            running.followers.append(MessageRef(follower_msg.chat_id, follower_msg.message_id, user_id))
+        return
+    
+    # Queue the transfer so the handler returns right away
+    if scheduler.queued() >= scheduler.max_queue:
+        await message.reply_text(
+            "❌ The queue is full right now. Please try again in a few minutes."
+        )
+        update_stats(success=False, user_id=user_id)
+        return
+    
+    # Register the job before the first await so repeats arriving meanwhile join it
+    position = scheduler.next_position(user_id)
+    # Shared-queue workers leave a 'new' job alone until it has a status message
+    job_id = journal.add(user_id, message.chat_id, None, mega_url, key, size, "new" if SHARED_QUEUE else "queued")
+    job = Job(user_id, message.chat_id, mega_url, job_id=job_id)
+    job.cache_key = key
+    job.size = size
+    if not SHARED_QUEUE:
+        inflight[key] = job
+    try:
+        job.status_msg = await message.reply_text(
+            f"🕒 Queued (position {position})\n\n"
+            "Use /queue to check your place in line.",
+            disable_notification=True
+        )
+    except Exception:
+        inflight.pop(key, None)
+        journal.remove(job_id)
+        raise
+    journal.update(job_id, message_id=job.status_msg.message_id)
+    try:
+        scheduler.submit(job)
+    except QueueFull:
+        journal.remove(job_id)
+        await deliver(job, "❌ The queue is full right now. Please try again in a few minutes.")
+        update_stats(success=False, user_id=user_id)
+
+async def batch_links(text, document=None):
+    """Unique Mega links in the command and an attached links file, in order"""
+    if document:
+        if document.file_size and document.file_size > BATCH_FILE_MAX_KB * 1024:
+            raise ValueError(f"The links file is too big; the limit is {BATCH_FILE_MAX_KB} KB")
+        data = await (await document.get_file()).download_as_bytearray()
+        text += "\n" + data.decode("utf-8", errors="replace")
+    links = {}
+    for match in MEGA_LINK.finditer(text):
+        link = match.group(0)
+        try:
+            key = cache_key(link)
+        except ValueError:
+            # Reported as unreadable once the batch is checked
+            key = link
+        links.setdefault(key, link)
+    if not links:
+        raise ValueError("No Mega.nz links found")
+    if len(links) > BATCH_MAX_LINKS:
+        raise ValueError(f"That's {len(links)} links; one batch can have at most {BATCH_MAX_LINKS}")
+    return list(links.values())
+
+def is_batch(mega_url):
+    return mega_url.startswith(BATCH_PREFIX)
+
+def batch_spec(mega_url):
+    """Links, sizes, skipped links and folder choice of a batch job"""
+    return json.loads(mega_url[len(BATCH_PREFIX):])
+
+async def queue_batch(message, user_id, links, single_folder):
+    """Check every link of a batch up front, then queue the readable ones as one job"""
+    # All file links are looked up in a single Mega request
+    found = await asyncio.to_thread(batch_sizes, links)
+    sizes = {}
+    skipped = {}
+    for url, result in found.items():
+        if isinstance(result, Exception):
+            skipped[url] = f"Could not read this link: {str(result)}"
+            continue
+        try:
+            admit(result)
+            sizes[url] = sum(result)
+        except AdmissionError as e:
+            skipped[url] = str(e)
+    for _ in skipped:
+        update_stats(success=False, user_id=user_id)
+    spec = {"links": list(sizes), "sizes": sizes, "skipped": skipped, "folder": single_folder}
+    if not sizes:
+        await message.reply_text(
+            batch_text(spec, {}), parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True
+        )
+        return
+    try:
+        size = admit([s for url in sizes for s in found[url]], user_reserved(user_id))
+    except AdmissionError as e:
+        await message.reply_text(f"❌ {str(e)}")
+        update_stats(success=False, user_id=user_id)
+        return
+    
+    if scheduler.queued() >= scheduler.max_queue:
+        await message.reply_text(
+            "❌ The queue is full right now. Please try again in a few minutes."
+        )
+        update_stats(success=False, user_id=user_id)
+        return
+    
+    position = scheduler.next_position(user_id)
+    mega_url = BATCH_PREFIX + json.dumps(spec)
+    job_id = journal.add(user_id, message.chat_id, None, mega_url, None, size, "new" if SHARED_QUEUE else "queued")
+    job = Job(user_id, message.chat_id, mega_url, job_id=job_id)
+    job.size = size
+    note = f"\n⚠️ {len(skipped)} links will be skipped; the summary lists why." if skipped else ""
+    try:
+        job.status_msg = await message.reply_text(
+            f"🕒 Queued a batch of {len(sizes)} links (position {position}){note}\n\n"
+            "Use /queue to check your place in line.",
+            disable_notification=True
+        )
+    except Exception:
+        journal.remove(job_id)
+        raise
+    journal.update(job_id, message_id=job.status_msg.message_id)
+    try:
+        scheduler.submit(job)
+    except QueueFull:
+        journal.remove(job_id)
+        await deliver(job, "❌ The queue is full right now. Please try again in a few minutes.")
+        update_stats(success=False, user_id=user_id)
+
+def user_reserved(user_id):
+    """Advertised bytes of a user's queued and running jobs"""
+    jobs, _ = scheduler.user_jobs(user_id)
+    return sum(job.size for job, _ in jobs)
+
+def result_text(download_page, content_url):
+    """Format the message with a conversion's GoFile links"""
+    return (
+        "✅ Conversion successful!\n\n"
+        f"📥 Download from GoFile: [Link]({download_page})\n"
+        f"🔗 Direct Content URL: [Link](https://gofile.io/d/{content_url})\n\n"
+        "⚠️ *Note:* Links expire after 60 days of inactivity"
     )
 
+def link_label(url, data=None):
+    """Short name for a link in a batch summary"""
+    if isinstance(data, dict) and data.get("fileName"):
+        return data["fileName"]
+    kind = "folder" if is_folder_url(url) else "file"
+    return f"{kind} {url.split('#')[0].rsplit('/', 1)[-1]}"
+
+def batch_text(spec, results):
+    """One message summing up a batch: its links or shared folder, then what failed"""
+    converted = [url for url in spec["links"] if not isinstance(results.get(url), Exception)]
+    failed = [(url, str(results[url])) for url in spec["links"] if isinstance(results.get(url), Exception)]
+    failed += list(spec["skipped"].items())
+    total = len(spec["links"]) + len(spec["skipped"])
+    lines = [f"{'✅' if converted else '❌'} Batch finished: {len(converted)} of {total} links converted"]
+    if converted and spec["folder"]:
+        lines += ["", f"📁 Everything is in one GoFile folder: [Link]({results[converted[0]]['downloadPage']})"]
+    elif converted:
+        lines.append("")
+        for url in converted:
+            data = results[url]
+            line = f"📥 [{escape_markdown(link_label(url, data))}]({data['downloadPage']})"
+            if data.get("failed"):
+                line += f" ({len(data['failed'])} of {data['files']} files failed)"
+            lines.append(line)
+    if failed:
+        lines += ["", "❌ Not converted:"]
+        lines += [f"• {escape_markdown(link_label(url))}: {escape_markdown(reason[:200])}" for url, reason in failed]
+    if converted:
+        lines += ["", "⚠️ *Note:* Links expire after 60 days of inactivity"]
+    # Stay inside Telegram's message size limit
+    text = lines[0]
+    for i, line in enumerate(lines[1:], 1):
+        if len(text) + len(line) > 3900:
+            return text + f"\n…and {len(lines) - i} more lines"
+        text += "\n" + line
+    return text
+
+def collect_followers(job):
+    """Close the job to followers and add the ones other processes stored for it"""
+    job.followers += [MessageRef(*row) for row in journal.finish(job.id)]
+
+async def deliver(job, text, success=False, **options):
+    """Stop accepting followers and put the final text in every status message of the job
+
+    Each follower's request is counted here, with the outcome it actually got.
+    """
+    job.result = (text, options)
+    job.success = success
+    if inflight.get(job.cache_key) is job:
+        del inflight[job.cache_key]
+    for msg in job.followers:
+        update_stats(success=success, cache="joined", user_id=msg.user_id)
+    for msg in [job.status_msg] + job.followers:
+        try:
+            await msg.edit_text(text, **options)
+        except Exception as e:
+            print(f"Error sending result of job {job.id}: {str(e)}")
+
+def status_editor(status_msg):
+    """Progress callback editing a status message, timed in the calling job's trace"""
+    def edit(text):
+        with tracing.span("telegram.edit"):
+            on_loop(status_msg.edit_text(text))
+    return tracing.bind(edit)
+
+def send_result(job, text, success=False, **options):
+    """Deliver a job's final text from its transfer thread
+
+    A send held up past on_loop's timeout, e.g. by a flood wait, carries on
+    in the background; it doesn't change the job's outcome.
+    """
+    with tracing.span("telegram.deliver", messages=1 + len(job.followers)) as span:
+        try:
+            on_loop(deliver(job, text, success, **options))
+        except concurrent.futures.TimeoutError:
+            span["timeout"] = True
+            print(f"Result of job {job.id} is taking long to send, still trying")
+
+def run_job(job):
+    """Run a queued job, tracing where its time goes"""
+    kind = "batch" if is_batch(job.mega_url) else "folder" if is_folder_url(job.mega_url) else "file"
+    with tracing.job(job.id, job.user_id, kind, queued=job.created):
+        if kind == "batch":
+            run_batch(job)
+        else:
+            run_conversion(job)
+
+def run_conversion(job):
+    """Run a queued conversion and report the result in its status message"""
+    status_msg = job.status_msg
+    journal.start(job.id)
+    progress = JobProgress(status_editor(status_msg), job.chat_id)
+    job.progress = progress
+    reporter.track(progress)
+    shaper = bandwidth.JobShaper(job.user_id, job.size)
     try:
-        # Step 1: Download from Mega.nz (no login required)
-        status_msg.edit_text(
-            "🔄 Processing your request...\n\n"
-            "1️⃣ Downloading from Mega.nz ✅\n"
-            "2️⃣ Uploading to GoFile.io"
+        if is_folder_url(job.mega_url):
+            data = convert_folder(job.mega_url, progress, shaper)
+        else:
+            data = convert(job.mega_url, journal, job.id, progress, shaper)
+            result_cache.put(job.cache_key, data['downloadPage'], data['code'])
+    except Exception as e:
+        reporter.untrack(progress)
+        error_msg = f"❌ Operation failed:\n\n`{str(e)}`"
+        collect_followers(job)
+        send_result(job, error_msg, parse_mode=ParseMode.MARKDOWN)
+        update_stats(success=False, cache="miss", activity=progress.summary(), user_id=job.user_id)
+        job_seconds.observe(time.time() - job.created, outcome="failure")
+        tracing.annotate(outcome="failure", error=str(e)[:200])
+    else:
+        # The file is on GoFile now, so nothing from here on may report a failure
+        reporter.untrack(progress)
+        download_page = data['downloadPage']
+        content_url = data['code']
+        text = result_text(download_page, content_url)
+        if data.get('failed'):
+            text += f"\n\n⚠️ {len(data['failed'])} of {data['files']} files could not be transferred"
+        if data.get('parts') and not data.get('files'):
+            text += f"\n\n🧩 Uploaded in {data['parts']} parts; join them with `cat` in order (.001, .002, ...)"
+        
+        # Send results to user and anyone who asked for the same file
+        collect_followers(job)
+        send_result(
+            job,
+            text,
+            success=True,
+            parse_mode=ParseMode.MARKDOWN,
+            disable_web_page_preview=True
         )
         
-        # Download to temporary directory
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Extract filename from URL for proper saving
-            filename = f"file_{int(time.time())}"
-            file_path = os.path.join(tmpdir, filename)
-            
-            # Download the file
-            mega_download_url(mega_url, file_path)
-            
-            # Step 2: Upload to GoFile.io (no login required)
-            status_msg.edit_text(
-                "🔄 Processing your request...\n\n"
-                "1️⃣ Downloading from Mega.nz ✅\n"
-                "2️⃣ Uploading to GoFile.io ⏳"
-            )
-            
-            # Get upload server
-            server_resp = requests.get('https://api.gofile.io/servers', timeout=10)
-            server_resp.raise_for_status()
-            server = server_resp.json()['data']['servers'][0]['name']
-            
-            # Upload file
-            upload_url = f'https://{server}.gofile.io/uploadFile'
-            with open(file_path, 'rb') as f:
-                files = {'file': (filename, f)}
-                gofile_resp = requests.post(upload_url, files=files, timeout=60)
-                gofile_resp.raise_for_status()
-            
-            # Parse response
-            data = gofile_resp.json()
-            if data.get('status') != 'ok':
-                raise Exception(f"GoFile upload failed: {data.get('message', 'Unknown error')}")
-            
-            download_page = data['data']['downloadPage']
-            content_url = data['data']['code']
-            
-            # Step 3: Send results to user
-            result_text = (
-                "✅ Conversion successful!\n\n"
-                f"📥 Download from GoFile: [Link]({download_page})\n"
-                f"🔗 Direct Content URL: [Link](https://gofile.io/d/{content_url})\n\n"
-                "⚠️ *Note:* Links expire after 60 days of inactivity"
+        # Update statistics
+        update_stats(success=True, cache="miss", activity=progress.summary(), user_id=job.user_id)
+        job_seconds.observe(time.time() - job.created, outcome="success")
+        tracing.annotate(outcome="success")
+    finally:
+        journal.remove(job.id)
+
+def run_batch(job):
+    """Run a batch job and put one summary of all its links in the status message"""
+    spec = batch_spec(job.mega_url)
+    status_msg = job.status_msg
+    journal.start(job.id)
+    progress = JobProgress(status_editor(status_msg), job.chat_id, "🔄 Processing your batch...")
+    job.progress = progress
+    reporter.track(progress)
+    shaper = bandwidth.JobShaper(job.user_id, job.size)
+    results = {}
+    try:
+        if not spec["folder"]:
+            # Files converted before, or before a restart, come straight from the cache
+            for url in spec["links"]:
+                cached = None if is_folder_url(url) else result_cache.get(cache_key(url))
+                if cached:
+                    results[url] = {"downloadPage": cached["download_page"], "code": cached["code"], "cached": True}
+        todo = [url for url in spec["links"] if url not in results]
+        if todo:
+            progress.set_total(sum(spec["sizes"][url] for url in todo))
+            for url, data in convert_batch(todo, progress, shaper, spec["folder"]).items():
+                results[url] = data
+                if not spec["folder"] and not is_folder_url(url) and not isinstance(data, Exception):
+                    result_cache.put(cache_key(url), data['downloadPage'], data['code'])
+    except Exception as e:
+        reporter.untrack(progress)
+        error_msg = f"❌ Batch failed:\n\n`{str(e)}`"
+        collect_followers(job)
+        send_result(job, error_msg, parse_mode=ParseMode.MARKDOWN)
+        update_stats(success=False, cache="miss", activity=progress.summary(), user_id=job.user_id)
+        job_seconds.observe(time.time() - job.created, outcome="failure")
+        tracing.annotate(outcome="failure", error=str(e)[:200])
+    else:
+        # The links are converted, so nothing from here on may report the batch as failed
+        reporter.untrack(progress)
+        
+        outcome = "success" if any(not isinstance(data, Exception) for data in results.values()) else "failure"
+        collect_followers(job)
+        send_result(
+            job,
+            batch_text(spec, results),
+            success=outcome == "success",
+            parse_mode=ParseMode.MARKDOWN,
+            disable_web_page_preview=True
+        )
+        
+        # One stats event per link, with the batch's traffic on the first
+        activity = progress.summary()
+        for url in spec["links"]:
+            data = results[url]
+            if isinstance(data, Exception):
+                update_stats(success=False, cache="miss", activity=activity, user_id=job.user_id)
+            else:
+                cache = "hit" if data.get("cached") else "miss"
+                update_stats(success=True, cache=cache, activity=activity, user_id=job.user_id)
+            activity = None
+        job_seconds.observe(time.time() - job.created, outcome=outcome)
+        tracing.annotate(outcome=outcome, links=len(spec["links"]))
+    finally:
+        journal.remove(job.id)
+
+def run_claimed(job):
+    """Run a job taken from the shared queue, editing its status message by id"""
+    if job.message_id:
+        job.status_msg = MessageRef(job.chat_id, job.message_id)
+    else:
+        # The bot stopped before it could reply to the request
+        try:
+            job.status_msg = on_loop(telegram_bot.send_message(
+                job.chat_id, f"♻️ Resuming job #{job.id}...", disable_notification=True
+            ))
+        except Exception as e:
+            print(f"Dropping job {job.id}, chat unreachable: {str(e)}")
+            journal.remove(job.id)
+            return
+    if job.attempts > JOB_MAX_ATTEMPTS:
+        # Whatever it does keeps taking its worker down with it
+        print(f"Dropping job {job.id} after {job.attempts - 1} attempts")
+        collect_followers(job)
+        on_loop(deliver(job, "❌ This job failed repeatedly and was dropped. Please try again later."))
+        journal.remove(job.id)
+        return
+    if job.attempts > 1:
+        print(f"♻️ Job {job.id} picked up again (attempt {job.attempts})")
+    run_job(job)
+
+if WORKER_ROLE == "transfer":
+    scheduler = SharedScheduler(journal, run_claimed)
+elif WORKER_ROLE == "bot":
+    scheduler = SharedScheduler(journal, run_claimed, workers=0)
+else:
+    scheduler = JobScheduler(run_job)
+reporter = ProgressReporter()
+
+def live_status():
+    """Queue depth and progress of this process's jobs, for the admin panel"""
+    jobs = [
+        {"id": job.id, "user_id": job.user_id, "started": job.started, **(job.progress.snapshot() if job.progress else {})}
+        for job in scheduler.running_jobs()
+    ]
+    return {
+        "worker": WORKER_NAME,
+        "role": WORKER_ROLE,
+        "queued": scheduler.queued(),
+        "jobs": jobs,
+        "traces": tracing.recent(tracing.TRACE_REPORT),
+    }
+
+live = LiveReporter(ADMIN_PANEL_URL, live_status)
+
+Gauge("jobs_queued", "Jobs waiting for a worker thread", function=scheduler.queued)
+
+async def resume_jobs(bot):
+    """Requeue jobs left unfinished by a previous run and tell their chats"""
+    entries = journal.unfinished()
+    clean_partials([entry["id"] for entry in entries])
+    for entry in entries:
+        # Only a partial file still on disk lets the job skip what it had downloaded
+        done_mb = resumable_bytes(entry) / (1024 * 1024)
+        resumed_from = f" from {done_mb:.1f} MB" if done_mb else ""
+        try:
+            status_msg = await bot.send_message(
+                entry["chat_id"],
+                f"♻️ The bot restarted. Resuming job #{entry['id']}{resumed_from}...",
+                reply_to_message_id=entry["message_id"],
+                allow_sending_without_reply=True,
+                disable_notification=True
             )
-            
-            status_msg.edit_text(
-                result_text, 
-                parse_mode=ParseMode.MARKDOWN, 
-                disable_web_page_preview=True
+        except Exception as e:
+            print(f"Dropping job {entry['id']}, chat unreachable: {str(e)}")
+            journal.remove(entry["id"])
+            continue
+        job = Job(entry["user_id"], entry["chat_id"], entry["mega_url"], status_msg, entry["id"])
+        job.cache_key = None if is_batch(entry["mega_url"]) else cache_key(entry["mega_url"])
+        job.size = entry["size"] or 0
+        if job.cache_key:
+            inflight.setdefault(job.cache_key, job)
+        scheduler.submit(job, force=True)
+    if entries:
+        print(f"♻️ Resumed {len(entries)} unfinished job(s)")
+
+@admin_only
+async def queue_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the caller's jobs and their queue positions"""
+    jobs, total = scheduler.user_jobs(update.effective_user.id)
+    if not jobs:
+        await update.message.reply_text(f"📭 You have no queued jobs ({total} waiting in total)")
+        return
+    
+    lines = []
+    for job, position in jobs:
+        if position is None:
+            lines.append(f"• Job #{job.id} — ⚙️ running")
+        else:
+            lines.append(f"• Job #{job.id} — position {position} of {total}")
+    await update.message.reply_text("📋 *Your jobs:*\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+@admin_only
+async def bandwidth_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show or change bandwidth limits while the bot runs"""
+    args = context.args
+    if len(args) == 2:
+        try:
+            bandwidth.set_limit(args[0].lower(), float(args[1]))
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {str(e)}")
+            return
+    elif args:
+        await update.message.reply_text(
+            "❌ Usage:\n"
+            "`/bandwidth` - Show limits\n"
+            "`/bandwidth <global|user|job> <MB/s>` - Set a limit per direction (0 = unlimited)\n"
+            "`/bandwidth priority <MB>` - Jobs up to this size go first",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    await update.message.reply_text(
+        "📶 *Bandwidth limits* (until restart):\n" + bandwidth.describe(),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+def top_phases(totals, count=3):
+    """The span names that took longest, as 'upload 8.1s, download 3.0s'"""
+    slowest = sorted(totals.items(), key=lambda item: item[1]["seconds"], reverse=True)[:count]
+    return ", ".join(f"{name} {total['seconds']:.1f}s" for name, total in slowest)
+
+def trace_text(trace):
+    """One job's trace as a monospaced table of time per span name, then its spans"""
+    lines = [
+        f"Job #{trace['job_id']} ({trace['kind']}) {trace.get('outcome', 'running')} "
+        f"in {format_duration(trace['seconds'])}",
+        "",
+        f"{'span':<18}{'count':>6}{'seconds':>10}{'MB':>9}{'errors':>7}",
+    ]
+    for name, total in sorted(trace["totals"].items(), key=lambda item: item[1]["seconds"], reverse=True):
+        lines.append(
+            f"{name:<18}{total['count']:>6}{total['seconds']:>10.2f}"
+            f"{total['bytes'] / 1048576:>9.1f}{total['errors']:>7}"
+        )
+    lines.append("")
+    for span in trace["spans"]:
+        attrs = " ".join(
+            f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in span.items() if key not in ("name", "start", "seconds")
+        )
+        lines.append(f"{span['start']:+.2f}s {span['seconds']:.2f}s {span['name']} {attrs}".rstrip())
+    if trace["dropped"]:
+        lines.append(f"... {trace['dropped']} more spans counted in the totals only")
+    text = "\n".join(lines).replace("`", "'")
+    if len(text) > 3900:
+        text = text[:3900] + "\n..."
+    return f"```\n{text}\n```"
+
+@admin_only
+async def trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show where recent jobs spent their time, or the spans of one job"""
+    if context.args:
+        try:
+            job_id = int(context.args[0].lstrip('#'))
+        except ValueError:
+            await update.message.reply_text("❌ Usage: `/trace [job id]`", parse_mode=ParseMode.MARKDOWN)
+            return
+        trace = tracing.find(job_id)
+        if not trace:
+            await update.message.reply_text(
+                f"❌ No trace of job #{job_id} here; only the last {tracing.TRACE_JOBS} jobs run by this process are kept"
             )
-            
-            # Update statistics
-            update_stats(success=True)
-            
-    except Exception as e:
-        error_msg = f"❌ Operation failed:\n\n`{str(e)}`"
-        status_msg.edit_text(error_msg, parse_mode=ParseMode.MARKDOWN)
-        update_stats(success=False)
+            return
+        await update.message.reply_text(trace_text(trace.to_dict()), parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    traces = tracing.recent(10)
+    if not traces:
+        note = " Jobs run in the transfer processes; see the admin panel." if WORKER_ROLE == "bot" else ""
+        await update.message.reply_text(f"📭 No job traces yet.{note}")
+        return
+    lines = [
+        f"• #{trace['job_id']} {trace['kind']} — {trace.get('outcome', 'running')} in "
+        f"{format_duration(trace['seconds'])}: {top_phases(trace['totals'])}"
+        for trace in traces
+    ]
+    await update.message.reply_text(
+        "🧭 *Recent jobs* (`/trace <id>` for details):\n" + escape_markdown("\n".join(lines)),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+@admin_only
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sample this process's stacks for a while and send them as a flamegraph input file"""
+    try:
+        seconds = int(context.args[0]) if context.args else profiler.PROFILE_SECONDS
+    except ValueError:
+        await update.message.reply_text("❌ Usage: `/profile [seconds]`", parse_mode=ParseMode.MARKDOWN)
+        return
+    seconds = max(1, min(seconds, profiler.PROFILE_MAX_SECONDS))
+    await update.message.reply_text(f"🔥 Profiling for {seconds}s...", disable_notification=True)
+    try:
+        counts, taken = await asyncio.to_thread(profiler.sample, seconds)
+    except profiler.ProfilerBusy as e:
+        await update.message.reply_text(f"❌ {str(e)}")
+        return
+    await update.message.reply_document(
+        document=profiler.folded(counts).encode(),
+        filename=f"profile-{WORKER_NAME}-{time.strftime('%Y%m%d-%H%M%S')}.folded",
+        caption=f"🔥 {taken} samples over {seconds}s. Open it in speedscope.app or pass it to flamegraph.pl"
+    )
 
 @admin_only
-def start(update: Update, context: CallbackContext):
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send welcome message"""
-    update.message.reply_text(
+    await update.message.reply_text(
         "🚀 *Mega to GoFile Converter*\n\n"
-        "Send me a Mega.nz file link with `/gofile` command and I'll convert it to GoFile.io link!\n\n"
+        "Send me a Mega.nz file or folder link with `/gofile` command and I'll convert it to GoFile.io link!\n\n"
         "✨ *Features:*\n"
         "• No login required\n"
         "• Automatic file conversion\n"
@@ -240,13 +799,13 @@ def start(update: Update, context: CallbackContext):
     )
 
 @admin_only
-def admin_command(update: Update, context: CallbackContext):
+async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin management command"""
     message = update.message
     args = context.args
     
     if not args:
-        message.reply_text(
+        await message.reply_text(
             "❌ Usage:\n"
             "`/admin add <user_id>` - Add new admin\n"
             "`/admin remove <user_id>` - Remove admin\n"
@@ -259,79 +818,77 @@ def admin_command(update: Update, context: CallbackContext):
     
     if subcommand == "add":
         if len(args) < 2:
-            message.reply_text("❌ Please provide a user ID to add")
+            await message.reply_text("❌ Please provide a user ID to add")
             return
             
         try:
             new_admin_id = int(args[1])
         except ValueError:
-            message.reply_text("❌ Invalid user ID. Must be a number")
+            await message.reply_text("❌ Invalid user ID. Must be a number")
             return
             
         if new_admin_id in admin_ids:
-            message.reply_text(f"⚠️ User `{new_admin_id}` is already an admin", parse_mode=ParseMode.MARKDOWN)
+            await message.reply_text(f"⚠️ User `{new_admin_id}` is already an admin", parse_mode=ParseMode.MARKDOWN)
             return
             
         # Send request to admin panel to add admin
         try:
-            response = requests.post(
+            response = await panel.post(
                 f"{ADMIN_PANEL_URL}/add_admin",
-                data={"admin_id": new_admin_id},
-                timeout=5
+                data={"admin_id": new_admin_id}
             )
             result = response.json()
             if result.get("success"):
                 load_admins()  # Refresh admin list
-                message.reply_text(f"✅ Added `{new_admin_id}` as admin", parse_mode=ParseMode.MARKDOWN)
+                await message.reply_text(f"✅ Added `{new_admin_id}` as admin", parse_mode=ParseMode.MARKDOWN)
             else:
-                message.reply_text(f"❌ Failed to add admin: {result.get('error', 'Unknown error')}")
+                await message.reply_text(f"❌ Failed to add admin: {result.get('error', 'Unknown error')}")
         except Exception as e:
-            message.reply_text(f"❌ Error adding admin: {str(e)}")
+            await message.reply_text(f"❌ Error adding admin: {str(e)}")
         
     elif subcommand == "remove":
         if len(args) < 2:
-            message.reply_text("❌ Please provide a user ID to remove")
+            await message.reply_text("❌ Please provide a user ID to remove")
             return
             
         try:
             remove_id = int(args[1])
         except ValueError:
-            message.reply_text("❌ Invalid user ID. Must be a number")
+            await message.reply_text("❌ Invalid user ID. Must be a number")
             return
             
         if remove_id not in admin_ids:
-            message.reply_text(f"⚠️ User `{remove_id}` is not an admin", parse_mode=ParseMode.MARKDOWN)
+            await message.reply_text(f"⚠️ User `{remove_id}` is not an admin", parse_mode=ParseMode.MARKDOWN)
             return
             
         # Send request to admin panel to remove admin
         try:
-            response = requests.post(
+            response = await panel.post(
                 f"{ADMIN_PANEL_URL}/remove_admin",
-                data={"admin_id": remove_id},
-                timeout=5
+                data={"admin_id": remove_id}
             )
             result = response.json()
             if result.get("success"):
                 load_admins()  # Refresh admin list
-                message.reply_text(f"✅ Removed `{remove_id}` from admins", parse_mode=ParseMode.MARKDOWN)
+                await message.reply_text(f"✅ Removed `{remove_id}` from admins", parse_mode=ParseMode.MARKDOWN)
             else:
-                message.reply_text(f"❌ Failed to remove admin: {result.get('error', 'Unknown error')}")
+                await message.reply_text(f"❌ Failed to remove admin: {result.get('error', 'Unknown error')}")
         except Exception as e:
-            message.reply_text(f"❌ Error removing admin: {str(e)}")
+            await message.reply_text(f"❌ Error removing admin: {str(e)}")
         
     elif subcommand == "list":
         if not admin_ids:
-            message.reply_text("📭 No admins configured")
+            await message.reply_text("📭 No admins configured")
             return
             
         admin_list = "\n".join([f"• `{admin_id}`" for admin_id in admin_ids])
-        message.reply_text(
+        await message.reply_text(
             f"📋 *Current Admins:*\n{admin_list}\n\n"
             "Use `/admin add <user_id>` to add new admins",
             parse_mode=ParseMode.MARKDOWN
         )
     else:
-        message.reply_text(
+        await message.reply_text(
             "❌ Unknown subcommand. Use:\n"
             "`add`, `remove`, or `list`",
             parse_mode=ParseMode.MARKDOWN
@@ -346,7 +903,7 @@ def setup_initial_admin():
         try:
             initial_admin = int(os.environ['INITIAL_ADMIN'])
             # Send request to admin panel to add admin
-            response = requests.post(
+            response = session.post(
                 f"{ADMIN_PANEL_URL}/add_admin",
                 data={"admin_id": initial_admin},
                 timeout=5
@@ -358,10 +915,86 @@ def setup_initial_admin():
         except Exception as e:
             print(f"❌ Error setting up initial admin: {str(e)}")
 
+async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "❌ Unknown command. Use /start for help",
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def on_startup(application):
+    """Resume journaled jobs, then start the transfer pool and background threads"""
+    global loop, telegram_bot
+    loop = asyncio.get_running_loop()
+    telegram_bot = application.bot
+    # Shared-queue jobs are picked up again by the transfer processes
+    if not SHARED_QUEUE:
+        await resume_jobs(application.bot)
+    scheduler.start()
+    reporter.start()
+    stats.start()
+    live.start()
+    start_metrics()
+    print(f"✅ Bot running with {len(admin_ids)} admins")
+    print(f"   Admin IDs: {', '.join(map(str, admin_ids))}")
+
+async def on_shutdown(application):
+    await panel.aclose()
+
+async def run_transfers():
+    """Serve the shared queue without taking Telegram updates"""
+    global loop, telegram_bot
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loop.add_signal_handler(signal.SIGINT, stopping.set)
+    async with Bot(TELEGRAM_BOT_TOKEN) as telegram_bot:
+        # Other processes may be writing partials for jobs added since the journal was read
+        clean_partials([entry["id"] for entry in journal.unfinished()], min_age=LEASE_SECONDS)
+        scheduler.start()
+        reporter.start()
+        stats.start()
+        live.start()
+        start_metrics()
+        print(f"✅ Transfer worker {WORKER_NAME} serving the shared queue with {scheduler.workers} threads")
+        await stopping.wait()
+        scheduler.stop()
+        print(f"Transfer worker {WORKER_NAME} stopped; its jobs are back in the queue")
+
+async def run_webhook(application):
+    """Run the bot on updates forwarded by the web service's webhook endpoint"""
+    stopping = asyncio.Event()
+    running_loop = asyncio.get_running_loop()
+    running_loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    running_loop.add_signal_handler(signal.SIGINT, stopping.set)
+    await application.initialize()
+    await on_startup(application)
+    listener = webhook.start_listener(application, running_loop)
+    try:
+        await webhook.register(application.bot)
+        await application.start()
+        await stopping.wait()
+        await application.stop()
+    finally:
+        # Telegram holds updates and retries while nothing is listening
+        listener.shutdown()
+        await application.shutdown()
+        await on_shutdown(application)
+
 def main():
     """Start the bot."""
     if not TELEGRAM_BOT_TOKEN:
         raise RuntimeError("TELEGRAM_BOT_TOKEN environment variable not set")
+    if WORKER_ROLE not in ("all", "bot", "transfer"):
+        raise RuntimeError(f"Unknown WORKER_ROLE {WORKER_ROLE}, use all, bot or transfer")
+    # kill -USR2 <pid> profiles any process, including transfer processes that take no commands
+    signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.start_background(WORKER_NAME))
+    if WORKER_ROLE == "transfer":
+        asyncio.run(run_transfers())
+        return
+    if TELEGRAM_MODE == "webhook" and not (webhook.WEBHOOK_URL and webhook.TELEGRAM_WEBHOOK_SECRET):
+        raise RuntimeError("Webhook mode needs WEBHOOK_URL and TELEGRAM_WEBHOOK_SECRET")
+    if TELEGRAM_MODE == "webhook":
+        webhook.check_listener(ADMIN_PANEL_URL)
     
     # Load admin configuration
     load_admins()
@@ -370,28 +1003,41 @@ def main():
     if not admin_ids:
         raise RuntimeError("No admins configured. Set INITIAL_ADMIN environment variable")
 
-    updater = Updater(TELEGRAM_BOT_TOKEN, use_context=True)
-    dp = updater.dispatcher
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        # Handlers only queue work, so many chats can be served at once
+        .concurrent_updates(True)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Command handlers
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("gofile", convert_mega_to_gofile))
-    dp.add_handler(CommandHandler("admin", admin_command))
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("gofile", convert_mega_to_gofile))
+    # A links file sent with /gofile as its caption
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r'^/gofile(@\w+)?(\s|$)'),
+        convert_mega_to_gofile
+    ))
+    application.add_handler(CommandHandler("admin", admin_command))
+    application.add_handler(CommandHandler("queue", queue_status))
+    application.add_handler(CommandHandler("bandwidth", bandwidth_command))
+    application.add_handler(CommandHandler("trace", trace_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     
     # Fallback for unknown commands (only for admins)
-    dp.add_handler(MessageHandler(
-        Filters.command & ~Filters.update.edited_message, 
-        lambda update, context: update.message.reply_text(
-            "❌ Unknown command. Use /start for help",
-            parse_mode=ParseMode.MARKDOWN
-        )
+    application.add_handler(MessageHandler(
+        filters.COMMAND & ~filters.UpdateType.EDITED_MESSAGE, 
+        unknown_command
     ))
 
-    # Start the Bot
-    updater.start_polling()
-    print(f"✅ Bot running with {len(admin_ids)} admins")
-    print(f"   Admin IDs: {', '.join(map(str, admin_ids))}")
-    updater.idle()
+    if TELEGRAM_MODE == "webhook":
+        asyncio.run(run_webhook(application))
+    else:
+        # Starting to poll also removes a webhook left by webhook mode
+        application.run_polling()
 
 if __name__ == '__main__':
     # Wait for web service to start